@@ -0,0 +1,125 @@
+"""
+Synthetic quiz corpus generator.
+
+Builds quiz documents in the same layout as the files in content*/ with
+configurable size, and renders them as TXT, ODT or DOCX bytes.
+
+Usage:
+    python -m benchmarks.corpus out_dir --heritages 20 --questions 50 --formats odt docx txt
+"""
+import argparse
+import datetime
+import io
+import os
+import random
+
+from bson import ObjectId
+
+# Word pools used to build question, option and explanation text.
+# The diacritics density is the probability of drawing from the Vietnamese pool.
+VIETNAMESE_WORDS = (
+    "di tích lịch sử đền chùa thành cổ vua triều đại nhà Lý Trần Hồ Lê Nguyễn "
+    "được xây dựng năm thế kỷ nào thờ phụng tưởng niệm kiến trúc cung điện "
+    "hoàng thành quốc gia văn hóa di sản thế giới công nhận người dân lễ hội"
+).split()
+ASCII_WORDS = (
+    "the heritage site was built in century which king dynasty temple pagoda "
+    "citadel palace museum festival culture world national park river mountain"
+).split()
+
+
+# Deterministic heritageIds: one ObjectId per second since 2025-01-01
+HERITAGE_ID_EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _words(rng, count, diacritics_density):
+    return " ".join(
+        rng.choice(VIETNAMESE_WORDS if rng.random() < diacritics_density else ASCII_WORDS)
+        for _ in range(count)
+    )
+
+
+def generate_lines(heritages=5, questions=12, option_words=4, diacritics_density=0.8, seed=0):
+    """
+    Returns the text lines of a synthetic quiz document.
+
+    Args:
+        heritages: Number of 'Heritage:' blocks.
+        questions: Questions per heritage.
+        option_words: Number of words in each option text.
+        diacritics_density: Share (0..1) of words taken from the Vietnamese word pool.
+        seed: Random seed, so the same arguments always produce the same document.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for h in range(heritages):
+        name = _words(rng, 4, diacritics_density).title()
+        lines.append(f"Heritage: {name} {h}: heritageId: {ObjectId.from_datetime(HERITAGE_ID_EPOCH + datetime.timedelta(seconds=h))}")
+        lines.append(f"Link tham khảo: https://example.org/heritage/{h}")
+        for q in range(1, questions + 1):
+            lines.append(f"Câu {q}: {_words(rng, 14, diacritics_density)}?")
+            for letter in "ABCD":
+                lines.append(f"{letter}. {_words(rng, option_words, diacritics_density)}")
+            correct = rng.choice("ABCD")
+            lines.append(f"Đáp án đúng: {correct}. {_words(rng, option_words, diacritics_density)}")
+            lines.append(f"Giải thích: {_words(rng, 25, diacritics_density)}.")
+    return lines
+
+
+def render_txt(lines):
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def render_odt(lines):
+    from odf.opendocument import OpenDocumentText
+    from odf.text import P
+
+    document = OpenDocumentText()
+    for line in lines:
+        document.text.addElement(P(text=line))
+    buffer = io.BytesIO()
+    document.write(buffer)
+    return buffer.getvalue()
+
+
+def render_docx(lines):
+    import docx
+
+    document = docx.Document()
+    for line in lines:
+        document.add_paragraph(line)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    ".txt": render_txt,
+    ".odt": render_odt,
+    ".docx": render_docx,
+}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Write synthetic quiz documents.")
+    arg_parser.add_argument("out_dir")
+    arg_parser.add_argument("--files", type=int, default=1, help="Documents per format")
+    arg_parser.add_argument("--heritages", type=int, default=5)
+    arg_parser.add_argument("--questions", type=int, default=12)
+    arg_parser.add_argument("--option-words", type=int, default=4)
+    arg_parser.add_argument("--diacritics-density", type=float, default=0.8)
+    arg_parser.add_argument("--formats", nargs="+", default=["odt", "docx", "txt"], choices=["odt", "docx", "txt"])
+    args = arg_parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for index in range(args.files):
+        lines = generate_lines(args.heritages, args.questions, args.option_words, args.diacritics_density, seed=index)
+        for fmt in args.formats:
+            path = os.path.join(args.out_dir, f"synthetic_{index:04d}.{fmt}")
+            with open(path, "wb") as f:
+                f.write(RENDERERS["." + fmt](lines))
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+In-process stand-in for a pymongo collection.
+
+Implements just the subset of the collection API used by db.py, and BSON-encodes
+every written document so that benchmarks still pay the serialization cost a
+real driver would. Not a general MongoDB emulator.
+"""
+import threading
+
+import bson
+from pymongo import UpdateOne
+from pymongo.results import BulkWriteResult
+
+
+def _matches(document, query):
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]:
+                return False
+        elif isinstance(condition, dict) and "$gte" in condition:
+            if value is None or value < condition["$gte"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return bson.decode(bson.encode(document))
+    # Dotted paths ("questions.content") return the whole top-level field
+    fields = {key.split(".")[0] for key, include in projection.items() if include}
+    result = {"_id": document["_id"]} if projection.get("_id", 1) else {}
+    for key in fields:
+        if key in document:
+            result[key] = document[key]
+    return bson.decode(bson.encode(result))
+
+
+class FakeCollection:
+    """Thread-safe in-memory collection holding BSON-encoded documents keyed by _id."""
+
+    def __init__(self):
+        self._documents = {}
+        # heritageId -> _id, so upserts keyed by heritageId do not scan every document
+        self._by_heritage = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, name=None, **kwargs):
+        name = name or f"{keys}_1"
+        self._indexes[name] = {"keys": keys, **kwargs}
+        return name
+
+    def index_information(self):
+        return dict(self._indexes)
+
+    def _apply_update(self, op):
+        # Supports the $set/$setOnInsert upserts produced by db.build_upsert
+        update = op._doc
+        if set(op._filter) == {"heritageId"}:
+            candidates = [self._by_heritage.get(op._filter["heritageId"])]
+        else:
+            candidates = list(self._documents)
+        for _id in candidates:
+            if _id is None:
+                continue
+            document = bson.decode(self._documents[_id])
+            if _matches(document, op._filter):
+                document.update(update.get("$set", {}))
+                self._documents[_id] = bson.encode(document)
+                return None
+        if not op._upsert:
+            return None
+        document = dict(op._filter)
+        document.update(update.get("$setOnInsert", {}))
+        document.update(update.get("$set", {}))
+        document.setdefault("_id", bson.ObjectId())
+        self._documents[document["_id"]] = bson.encode(document)
+        if "heritageId" in document:
+            self._by_heritage[document["heritageId"]] = document["_id"]
+        return document["_id"]
+
+    def bulk_write(self, requests, ordered=True):
+        upserted = []
+        matched = 0
+        with self._lock:
+            for index, op in enumerate(requests):
+                if not isinstance(op, UpdateOne):
+                    raise NotImplementedError(f"FakeCollection does not support {type(op).__name__}")
+                upserted_id = self._apply_update(op)
+                if upserted_id is None:
+                    matched += 1
+                else:
+                    upserted.append({"index": index, "_id": upserted_id})
+        return BulkWriteResult(
+            {"nInserted": 0, "nUpserted": len(upserted), "nMatched": matched, "nModified": matched,
+             "nRemoved": 0, "upserted": upserted},
+            acknowledged=True,
+        )
+
+    def find(self, query=None, projection=None):
+        with self._lock:
+            documents = [bson.decode(encoded) for encoded in self._documents.values()]
+        return [_project(document, projection) for document in documents if _matches(document, query or {})]
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def count_documents(self, query):
+        return len(self.find(query))
@@ -0,0 +1,74 @@
+"""
+Import-time budget for the API (cold start of `import main`).
+
+Imports `main` in fresh interpreters and fails (exit code 1) when:
+  * the median import time exceeds the budget, or
+  * a module that must be loaded lazily (format readers, MongoDB driver,
+    scikit-learn...) was imported by `import main`.
+
+The second check is deterministic and catches most regressions even on
+machines too noisy for the timing check.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "900"))
+# Modules that `import main` must not load; they are imported on first use
+LAZY_MODULES = ("docx", "odf", "lxml", "pymongo", "bson", "dotenv", "numpy", "scipy", "sklearn", "underthesea")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_import(runs):
+    """Imports main in `runs` fresh interpreters; returns (timings in ms, eagerly loaded lazy modules)."""
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True)
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(sample["ms"])
+        loaded.update(sample["loaded"])
+    return timings, sorted(loaded)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Check the import time of the API against a budget.")
+    arg_parser.add_argument("--runs", type=int, default=7)
+    arg_parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    args = arg_parser.parse_args(argv)
+
+    # The first run warms the bytecode cache and the OS page cache and is not counted
+    measure_import(1)
+    timings, loaded = measure_import(args.runs)
+    median = statistics.median(timings)
+    print(f"import main: median {median:.1f} ms, min {min(timings):.1f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: modules that should load lazily were imported by main: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: import time {median:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+"""
+Load harness for the upload API.
+
+Starts main.app under uvicorn in a separate process, backed by the in-process
+FakeCollection instead of MongoDB, and replays a mix of ODT/DOCX/TXT uploads
+at a configurable concurrency and arrival rate. The documents are the real
+files in content*/; their DOCX and TXT variants are rendered from the same
+lines with benchmarks/corpus.py.
+
+Two traffic models:
+  * closed loop (default): `--concurrency` clients each send their next
+    request as soon as the previous one completes;
+  * open loop (`--rate R`): requests arrive as a Poisson process at R per
+    second and are served by `--concurrency` clients. Latency is measured
+    from the scheduled arrival time, so time spent waiting for a free client
+    counts (no coordinated omission).
+
+Throughput and p50/p95/p99 latency of the successful (2xx) uploads, the
+rate of uploads rejected by the admission control (429) and the rate of
+other errors are reported per format and overall, after a short unmeasured
+warm-up, and saved as JSON so runs can be compared across commits. Fast 429s
+are kept out of the latencies so that shedding load cannot look like a
+speed-up.
+
+The server runs in a temporary directory, which also holds its journal,
+log file and parse cache; `--max-concurrent-uploads` and `--parse-workers`
+are passed to it as MAX_CONCURRENT_UPLOADS and PARSE_WORKERS.
+
+Usage:
+    python -m benchmarks.load
+    python -m benchmarks.load --requests 600 --concurrency 16 --mix odt=2,docx=1,txt=1
+    python -m benchmarks.load --rate 20 --duration 30 --parse-cache
+    python -m benchmarks.load --concurrency 32 --max-concurrent-uploads 8 --parse-workers 4
+    python -m benchmarks.load --url http://127.0.0.1:8000   # an already running server
+    python -m benchmarks.load --baseline benchmarks/results/load-<previous>.json --max-regression 0.2
+"""
+import argparse
+import glob
+import http.client
+import json
+import math
+import os
+import platform
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+CONTENT_TYPES = {
+    ".odt": "application/vnd.oasis.opendocument.text",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+}
+
+
+# --- Server ---
+
+def serve(port, journal_path, parse_cache=False):
+    """
+    Runs main.app on 127.0.0.1:`port` with the FakeCollection stand-in (blocking).
+    Uploads are journaled to `journal_path`, never to the real upload journal,
+    whose pending entries would otherwise be replayed into the fake and truncated.
+    """
+    if not parse_cache:
+        # Without the cache every upload is decoded and parsed, like a first upload
+        os.environ["PARSE_CACHE_DIR"] = ""
+        os.environ["PARSE_CACHE_SIZE"] = "0"
+    os.environ.setdefault("METRICS_LOG_FILE", os.devnull)
+    # The collection starts empty on every run: nothing to snapshot or restore
+    os.environ["SEARCH_SNAPSHOT_PATH"] = ""
+    os.environ["QUIZ_JOURNAL_PATH"] = journal_path
+
+    import uvicorn
+
+    import db
+    import main as app_module
+    from benchmarks.fake_mongo import FakeCollection
+
+    collection = FakeCollection()
+    app_module.init_db = lambda: db.init_db(collection)
+    uvicorn.run(app_module.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(parse_cache, journal_dir, max_concurrent_uploads=None, parse_workers=None, timeout=60):
+    """
+    Starts `serve` in a child process running in `journal_dir`, so that its
+    journal, app.log and parse cache stay out of the repository, and waits
+    until it answers. Returns (process, base url).
+    """
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.load", "--serve", "--port", str(port),
+               "--journal", os.path.join(journal_dir, "quiz_journal.jsonl")]
+    if parse_cache:
+        command.append("--parse-cache")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    if max_concurrent_uploads is not None:
+        env["MAX_CONCURRENT_UPLOADS"] = str(max_concurrent_uploads)
+    if parse_workers is not None:
+        env["PARSE_WORKERS"] = str(parse_workers)
+    process = subprocess.Popen(command, cwd=journal_dir, env=env, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            status, _body = request(url, "GET", "/")
+            if status == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not start within {timeout}s")
+
+
+# --- Client ---
+
+def request(url, method, path, body=None, headers=None, timeout=120):
+    """Sends one HTTP request with a fresh connection; returns (status, body)."""
+    parsed = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def multipart_body(filename, file_bytes, content_type):
+    """Encodes one file as a multipart/form-data body for POST /upload/. Returns (body, content type)."""
+    boundary = uuid.uuid4().hex
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n").encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return head + file_bytes + tail, f"multipart/form-data; boundary={boundary}"
+
+
+def load_documents():
+    """Returns {format: [(filename, multipart body, content type), ...]} built from content*/."""
+    from benchmarks.corpus import RENDERERS
+    from parser import read_quiz_file
+
+    documents = {}
+    for path in sorted(glob.glob(os.path.join(REPO_ROOT, "content*", "*"))):
+        file_extension = os.path.splitext(path)[1].lower()
+        if file_extension not in CONTENT_TYPES:
+            continue
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        lines = read_quiz_file(file_bytes, file_extension)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        variants = {file_extension: file_bytes}
+        for extension, render in RENDERERS.items():
+            variants.setdefault(extension, render(lines))
+        for extension, content in variants.items():
+            body, content_type = multipart_body(stem + extension, content, CONTENT_TYPES[extension])
+            documents.setdefault(extension.lstrip("."), []).append((stem + extension, body, content_type))
+    return documents
+
+
+def parse_mix(mix):
+    """'odt=2,docx=1' -> {'odt': 2.0, 'docx': 1.0}"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip().lstrip(".")] = float(weight or 1)
+    return weights
+
+
+def build_schedule(documents, weights, count, rate, seed):
+    """Returns [(arrival offset in seconds or None, format, document), ...] for the run."""
+    rng = random.Random(seed)
+    formats = [fmt for fmt in weights if documents.get(fmt)]
+    if not formats:
+        raise ValueError(f"No documents for the requested formats {sorted(weights)}")
+    chosen = rng.choices(formats, weights=[weights[fmt] for fmt in formats], k=count)
+    schedule = []
+    arrival = 0.0
+    for fmt in chosen:
+        if rate:
+            arrival += rng.expovariate(rate)
+        schedule.append((arrival if rate else None, fmt, rng.choice(documents[fmt])))
+    return schedule
+
+
+def run_load(url, schedule, concurrency):
+    """Replays `schedule` against `url` with `concurrency` clients. Returns (samples, elapsed seconds)."""
+    work = queue.Queue()
+    for item in schedule:
+        work.put(item)
+    samples = []
+    samples_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def client():
+        while True:
+            try:
+                arrival, fmt, (filename, body, content_type) = work.get_nowait()
+            except queue.Empty:
+                return
+            if arrival is not None:
+                # Open loop: wait for the scheduled arrival, then measure from it
+                delay = started + arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent = started + arrival
+            else:
+                sent = time.perf_counter()
+            try:
+                status, _ = request(url, "POST", "/upload/", body=body, headers={"Content-Type": content_type})
+                error = None if 200 <= status < 300 else f"HTTP {status}"
+            except OSError as e:
+                status, error = None, type(e).__name__
+            with samples_lock:
+                samples.append({"format": fmt, "file": filename, "status": status, "error": error,
+                                "latencyMs": (time.perf_counter() - sent) * 1000})
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+# --- Report ---
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return round(sorted_values[index], 3)
+
+
+def summarize(samples, elapsed):
+    """
+    Per-format and overall throughput and latency percentiles of the
+    successful uploads, rejection rate (429) and rate of other errors.
+    """
+    groups = {"all": samples}
+    for sample in samples:
+        groups.setdefault(sample["format"], []).append(sample)
+    summary = {}
+    for name, group in sorted(groups.items()):
+        latencies = sorted(sample["latencyMs"] for sample in group if sample["error"] is None)
+        rejected = sum(1 for sample in group if sample["status"] == 429)
+        errors = {}
+        for sample in group:
+            if sample["error"] and sample["status"] != 429:
+                errors[sample["error"]] = errors.get(sample["error"], 0) + 1
+        error_count = sum(errors.values())
+        summary[name] = {
+            "requests": len(group),
+            "succeeded": len(latencies),
+            "throughputRps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50Ms": percentile(latencies, 0.50),
+            "p95Ms": percentile(latencies, 0.95),
+            "p99Ms": percentile(latencies, 0.99),
+            "maxMs": round(latencies[-1], 3) if latencies else None,
+            "rejected": rejected,
+            "rejectionRate": round(rejected / len(group), 4) if group else 0.0,
+            "errorRate": round(error_count / len(group), 4) if group else 0.0,
+            "errors": errors,
+        }
+    return summary
+
+
+def compare(results, baseline, max_regression):
+    """Returns the formats whose p95 latency or error rate got worse than the baseline allows."""
+    regressions = []
+    for name, stats in results["summary"].items():
+        before = baseline.get("summary", {}).get(name)
+        if not before:
+            continue
+        if before["p95Ms"] and stats["p95Ms"] is not None and stats["p95Ms"] > before["p95Ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95Ms']}ms -> {stats['p95Ms']}ms")
+        if stats["rejectionRate"] > before.get("rejectionRate", 0.0):
+            regressions.append(f"{name}: rejection rate {before.get('rejectionRate', 0.0)} -> {stats['rejectionRate']}")
+        if stats["errorRate"] > before["errorRate"]:
+            regressions.append(f"{name}: error rate {before['errorRate']} -> {stats['errorRate']}")
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Replay concurrent quiz uploads against the API.")
+    arg_parser.add_argument("--requests", type=int, default=300, help="Number of uploads (closed loop)")
+    arg_parser.add_argument("--duration", type=float, help="Open loop only: run for this many seconds instead")
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrival rate in requests/s (0 = closed loop)")
+    arg_parser.add_argument("--mix", default="odt=1,docx=1,txt=1", help="Format weights, e.g. odt=2,docx=1,txt=1")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--warmup", type=int, default=10,
+                            help="Uploads sent one at a time before measuring (not counted)")
+    arg_parser.add_argument("--parse-cache", action="store_true", help="Keep the parse cache on (repeated files skip parsing)")
+    arg_parser.add_argument("--max-concurrent-uploads", type=int,
+                            help="MAX_CONCURRENT_UPLOADS of the started server (default: its own default)")
+    arg_parser.add_argument("--parse-workers", type=int,
+                            help="PARSE_WORKERS of the started server (default: its own default)")
+    arg_parser.add_argument("--url", help="Target an already running server instead of starting one")
+    arg_parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/load-<time>-<rev>.json)")
+    arg_parser.add_argument("--baseline", help="Previous load results to compare against")
+    arg_parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown vs. baseline (0.2 = 20%%)")
+    arg_parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    arg_parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    arg_parser.add_argument("--journal", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port, args.journal, args.parse_cache)
+        return 0
+
+    documents = load_documents()
+    count = args.requests
+    if args.rate and args.duration:
+        count = max(1, int(args.rate * args.duration))
+    schedule = build_schedule(documents, parse_mix(args.mix), count, args.rate, args.seed)
+
+    process = None
+    url = args.url
+    journal_dir = None
+    if url is None:
+        journal_dir = tempfile.mkdtemp(prefix="load-journal-")
+        process, url = start_server(args.parse_cache, journal_dir, args.max_concurrent_uploads, args.parse_workers)
+    try:
+        # Warm the server up first (lazy imports, tokenizer model, first index build)
+        run_load(url, build_schedule(documents, parse_mix(args.mix), args.warmup, 0, args.seed + 1), 1)
+        samples, elapsed = run_load(url, schedule, args.concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if journal_dir is not None:
+            shutil.rmtree(journal_dir, ignore_errors=True)
+
+    from benchmarks.run import git_revision
+    results = {
+        "revision": git_revision(),
+        "createdAt": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("serve", "port", "journal")},
+        "documents": {fmt: len(files) for fmt, files in documents.items()},
+        "elapsedSeconds": round(elapsed, 3),
+        "summary": summarize(samples, elapsed),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{results['createdAt']}-{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{count} uploads, concurrency {args.concurrency}, "
+          f"{'rate ' + str(args.rate) + '/s' if args.rate else 'closed loop'}, {elapsed:.2f}s")
+    print(f"  {'format':<6} {'reqs':>6} {'ok':>6} {'ok rps':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+          f"{'429':>8} {'errors':>8}")
+    for name, stats in results["summary"].items():
+        p50, p95, p99 = (f"{stats[key]:.1f}" if stats[key] is not None else "-" for key in ("p50Ms", "p95Ms", "p99Ms"))
+        print(f"  {name:<6} {stats['requests']:>6} {stats['succeeded']:>6} {stats['throughputRps']:>8.2f} "
+              f"{p50:>10} {p95:>10} {p99:>10} {stats['rejectionRate']:>8.2%} {stats['errorRate']:>8.2%}")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
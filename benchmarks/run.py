@@ -0,0 +1,221 @@
+"""
+Micro-benchmarks for the reader, parser, serializer and insertion stages.
+
+Each stage is timed separately on the real documents in content*/ and on a
+synthetic corpus of configurable size (see benchmarks/corpus.py). Results are
+written as JSON so runs can be compared across commits.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --heritages 50 --questions 40 --repeat 5 --output results.json
+    python -m benchmarks.run --baseline benchmarks/results/<previous>.json --max-regression 0.2
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import db
+from benchmarks.corpus import RENDERERS, generate_lines
+from benchmarks.fake_mongo import FakeCollection
+from responses import dumps_quiz
+from parser import (parse_quiz_lines, parse_quiz_models, read_docx_file, read_docx_file_python_docx,
+                    read_odt_file, read_odt_file_odfpy, read_txt_file)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+READERS = {
+    ".odt": read_odt_file,
+    ".docx": read_docx_file,
+    ".txt": read_txt_file,
+}
+# Library-based readers the streaming readers replaced, timed and checked for equivalence
+REFERENCE_READERS = {
+    ".odt": ("odfpy", read_odt_file_odfpy),
+    ".docx": ("python-docx", read_docx_file_python_docx),
+}
+
+
+def convert_objectid_to_str(data):
+    """
+    Reference serializer dumps_quiz replaced: recursively copies the quiz tree
+    with every bson.ObjectId turned into its string, before json.dumps.
+    """
+    from bson import ObjectId
+
+    if isinstance(data, list):
+        return [convert_objectid_to_str(item) for item in data]
+    elif isinstance(data, dict):
+        return {key: convert_objectid_to_str(value) for key, value in data.items()}
+    elif isinstance(data, ObjectId):
+        return str(data)
+    return data
+
+
+def time_stage(func, repeat):
+    """Runs `func` `repeat` times and returns timing statistics in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "minMs": round(min(timings), 3),
+        "medianMs": round(statistics.median(timings), 3),
+        "meanMs": round(statistics.fmean(timings), 3),
+    }
+
+
+def measure_memory(func):
+    """
+    Calls `func` under tracemalloc and returns the memory held by its result
+    and the peak during the call, in KiB.
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {"retainedKiB": round(retained / 1024, 1), "peakKiB": round(peak / 1024, 1)}
+
+
+def load_real_documents():
+    """Returns {format: [bytes, ...]} for the documents shipped in content*/."""
+    documents = {}
+    for path in sorted(glob.glob(os.path.join(REPO_ROOT, "content*", "*"))):
+        file_extension = os.path.splitext(path)[1].lower()
+        if file_extension in READERS:
+            with open(path, "rb") as f:
+                documents.setdefault(file_extension, []).append(f.read())
+    return documents
+
+
+def benchmark_corpus(documents, repeat):
+    """Times every stage for one corpus ({format: [bytes, ...]})."""
+    results = {}
+    for file_extension, files in sorted(documents.items()):
+        reader = READERS[file_extension]
+        fmt = file_extension.lstrip(".")
+        results[f"read_{fmt}_file"] = time_stage(lambda: [reader(b) for b in files], repeat)
+
+        lines = [reader(b) for b in files]
+        if file_extension in REFERENCE_READERS:
+            library, reference_reader = REFERENCE_READERS[file_extension]
+            results[f"read_{fmt}_file[{library}]"] = time_stage(lambda: [reference_reader(b) for b in files], repeat)
+            # The streaming DOCX reader also returns table-cell paragraphs, so only
+            # documents without tables are expected to match exactly
+            mismatches = sum(1 for b, l in zip(files, lines) if reference_reader(b) != l)
+            results.setdefault("_equivalence", {})[fmt] = {"files": len(files), "mismatches": mismatches}
+        results[f"parse_quiz_lines[{fmt}]"] = time_stage(lambda: [parse_quiz_lines(l) for l in lines], repeat)
+
+    # Serializer and insertion stages run once per corpus, on the quizzes of every format
+    lines = [READERS[ext](b) for ext, files in sorted(documents.items()) for b in files]
+    quizzes = [quiz for l in lines for quiz in parse_quiz_lines(l)]
+    results["parse_quiz_models"] = time_stage(lambda: [list(parse_quiz_models(l)) for l in lines], repeat)
+    # Memory held by every parsed quiz of the corpus: the dict output vs. the slotted models
+    results["_memory"] = {
+        "dicts": measure_memory(lambda: [quiz for l in lines for quiz in parse_quiz_lines(l)]),
+        "models": measure_memory(lambda: [quiz for l in lines for quiz in parse_quiz_models(l)]),
+    }
+    results["convert_objectid_to_str"] = time_stage(
+        lambda: json.dumps(convert_objectid_to_str(quizzes), ensure_ascii=False), repeat)
+    results["dumps_quiz"] = time_stage(lambda: dumps_quiz(quizzes), repeat)
+
+    def insert():
+        db.insert_to_db(quizzes, collection=FakeCollection())
+    results["insert_to_db[fake]"] = time_stage(insert, repeat)
+
+    results["_size"] = {
+        "files": sum(len(files) for files in documents.values()),
+        "bytes": sum(len(b) for files in documents.values() for b in files),
+        "quizzes": len(quizzes),
+        "questions": sum(len(quiz["questions"]) for quiz in quizzes),
+    }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, max_regression):
+    """Returns a list of 'corpus/stage' entries whose median slowed down by more than `max_regression`."""
+    regressions = []
+    for corpus, stages in results["corpora"].items():
+        for stage, stats in stages.items():
+            before = baseline.get("corpora", {}).get(corpus, {}).get(stage)
+            if stage.startswith("_") or not before:
+                continue
+            if stats["medianMs"] > before["medianMs"] * (1 + max_regression):
+                regressions.append(f"{corpus}/{stage}: {before['medianMs']}ms -> {stats['medianMs']}ms")
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the quiz reader/parser/serializer stages.")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--files", type=int, default=5, help="Synthetic documents per format")
+    arg_parser.add_argument("--heritages", type=int, default=5)
+    arg_parser.add_argument("--questions", type=int, default=12)
+    arg_parser.add_argument("--option-words", type=int, default=4)
+    arg_parser.add_argument("--diacritics-density", type=float, default=0.8)
+    arg_parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/<time>-<rev>.json)")
+    arg_parser.add_argument("--baseline", help="Previous results file to compare against")
+    arg_parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed median slowdown vs. baseline (0.2 = 20%%)")
+    args = arg_parser.parse_args(argv)
+
+    synthetic = {}
+    for index in range(args.files):
+        lines = generate_lines(args.heritages, args.questions, args.option_words, args.diacritics_density, seed=index)
+        for file_extension, render in RENDERERS.items():
+            synthetic.setdefault(file_extension, []).append(render(lines))
+
+    results = {
+        "revision": git_revision(),
+        "createdAt": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "corpora": {
+            "real": benchmark_corpus(load_real_documents(), args.repeat),
+            "synthetic": benchmark_corpus(synthetic, args.repeat),
+        },
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['createdAt']}-{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for corpus, stages in results["corpora"].items():
+        print(f"[{corpus}] {stages['_size']} equivalence: {stages.get('_equivalence', {})}")
+        print(f"  memory: {stages['_memory']}")
+        for stage, stats in stages.items():
+            if not stage.startswith("_"):
+                print(f"  {stage:<32} median {stats['medianMs']:>10.3f} ms   min {stats['minMs']:>10.3f} ms")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
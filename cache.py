@@ -0,0 +1,138 @@
+"""
+Content-hash cache for parsed uploads.
+
+Uploads are keyed by the SHA-256 of their bytes (plus the file extension and
+PARSE_CACHE_VERSION), so re-uploading an unchanged file costs one hash
+computation and returns the exact same quiz structure, ObjectIds included.
+
+Two tiers:
+  * a bounded in-memory LRU, and
+  * an on-disk directory of BSON files that survives restarts.
+
+Entries are stored as encoded BSON in both tiers: it is compact, keeps
+ObjectIds native, and decoding hands every caller its own fresh copy.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a reader or the parser changes its output, so stale entries are ignored
+PARSE_CACHE_VERSION = 2
+
+PARSE_CACHE_DIR = settings.get_str("PARSE_CACHE_DIR", ".parse_cache")
+PARSE_CACHE_SIZE = settings.get_int("PARSE_CACHE_SIZE", 256)
+
+
+def content_hasher(file_extension: str):
+    """Returns a SHA-256 object primed for a file of this extension; feed it the file bytes."""
+    return hashlib.sha256(f"v{PARSE_CACHE_VERSION}:{file_extension.lower()}:".encode("utf-8"))
+
+
+def content_key(file_bytes: bytes, file_extension: str) -> str:
+    """Returns the cache key (hex SHA-256) for an uploaded file."""
+    digest = content_hasher(file_extension)
+    digest.update(file_bytes)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe dictionary that evicts the least recently used entry beyond `max_entries`."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ParseCache:
+    """
+    Two-tier cache of {'lines': [...], 'quizzes': [...]} parse results.
+
+    Args:
+        max_entries: Size of the in-memory LRU tier.
+        cache_dir: Directory of the on-disk tier, or None/"" to keep it in memory only.
+    """
+
+    def __init__(self, max_entries=PARSE_CACHE_SIZE, cache_dir=PARSE_CACHE_DIR):
+        self.memory = LRUCache(max_entries)
+        self.cache_dir = cache_dir or None
+
+    def _path(self, key):
+        # Two-character fan-out keeps directories small with many entries
+        return os.path.join(self.cache_dir, key[:2], key + ".bson")
+
+    def get(self, key):
+        """Returns a fresh copy of the cached parse result for `key`, or None."""
+        import bson
+
+        encoded = self.memory.get(key)
+        if encoded is None and self.cache_dir:
+            try:
+                with open(self._path(key), "rb") as f:
+                    encoded = f.read()
+            except OSError:
+                return None
+            self.memory.put(key, encoded)
+        if encoded is None:
+            return None
+        try:
+            return bson.decode(encoded)
+        except Exception:
+            # Truncated or corrupt entry: drop it and parse again
+            self.memory.pop(key)
+            return None
+
+    def put(self, key, lines, quizzes):
+        """Stores the extracted lines and parsed quizzes of one file."""
+        import bson
+
+        encoded = bson.encode({"lines": list(lines), "quizzes": quizzes})
+        self.memory.put(key, encoded)
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write parse cache entry {path}: {e}")
+
+
+# Shared cache used by the upload pipeline
+parse_cache = ParseCache()
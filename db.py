@@ -1,69 +1,253 @@
-import os
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
-from bson import ObjectId
-from bson import json_util # Import json_util for BSON serialization
+import logging
 import time
-from parser import read_odt_file, parse_quiz_lines
-from dotenv import find_dotenv, load_dotenv
-# No need to import json if only using json_util for pymongo results
+import settings
+from parser import read_quiz_file, parse_quiz_lines
+from cache import content_key, parse_cache
+from metrics import FILES, PARSE_CACHE_HITS, observe_stage, record_quizzes, stage
+# pymongo is imported by the functions that talk to MongoDB, on first use,
+# so importing this module (and the app) stays cheap.
 
-load_dotenv(find_dotenv(), override=True)
-# --- Configuration (use environment variables) ---
-MONGO_URI = os.getenv("MONGODB_URI")
+logger = logging.getLogger(__name__)
+
+# --- Configuration (use environment variables, see settings.py) ---
+MONGO_URI = settings.get_str("MONGODB_URI")
 MONGO_TEST_DB = "History_Heritage_Database"
 MONGO_TEST_COLLECTION = "knowledgeTest"
 
-# --- Connection and Test Operations Snippet ---
+# --- Upload pipeline ---
+# Bulk loading of whole content directories lives in ingest.py.
+
+def parse_file_bytes(file_bytes, file_extension):
+    """
+    Decodes and parses one file, without cache or metrics, so it can run in
+    a worker process.
+
+    Returns:
+        (lines, quizzes, timings) where timings holds the 'decode' and 'parse'
+        durations in seconds.
+    """
+    started = time.perf_counter()
+    line_lst = read_quiz_file(file_bytes, file_extension)
+    decoded = time.perf_counter()
+    quizzes = parse_quiz_lines(line_lst)
+    return line_lst, quizzes, {"decode": decoded - started, "parse": time.perf_counter() - decoded}
+
+
+def get_cached_quizzes(key, file_extension):
+    """Returns the cached quizzes for a content key, or None, recording the hit."""
+    cached = parse_cache.get(key)
+    if cached is None:
+        return None
+    PARSE_CACHE_HITS.inc()
+    FILES.inc(format=file_extension.lower().lstrip("."), status="cached")
+    record_quizzes(cached["quizzes"])
+    return cached["quizzes"]
+
+
+def store_parse_result(key, file_extension, line_lst, quizzes, timings):
+    """Records the metrics of a fresh parse and adds it to the parse cache."""
+    file_format = file_extension.lower().lstrip(".")
+    for stage_name, seconds in timings.items():
+        observe_stage(stage_name, seconds, file_format)
+    FILES.inc(format=file_format, status="parsed")
+    record_quizzes(quizzes)
+    parse_cache.put(key, line_lst, quizzes)
+
+
+def record_parse_error(file_extension):
+    FILES.inc(format=file_extension.lower().lstrip("."), status="error")
+
+
+def processed_file(file_bytes, file_extension, parse=parse_file_bytes):
+    """
+    Single pipeline stage for an uploaded file: picks the reader for
+    `file_extension`, decodes the bytes once, runs `parse_quiz_lines` once
+    and returns every quiz found in the file (one per 'Heritage:' block).
+
+    Results are cached under the SHA-256 of the bytes, so an unchanged
+    re-upload skips reading/parsing and keeps the same ObjectIds.
+
+    Blocking (hashing, cache files, parsing). `parse` may hand the decoding
+    and parsing to another executor, e.g. a process pool.
+    """
+    key = content_key(file_bytes, file_extension)
+    cached = get_cached_quizzes(key, file_extension)
+    if cached is not None:
+        return cached
+    try:
+        line_lst, quizzes, timings = parse(file_bytes, file_extension)
+    except Exception:
+        record_parse_error(file_extension)
+        raise
+    store_parse_result(key, file_extension, line_lst, quizzes, timings)
+    return quizzes
 
-# Example Usage (for testing the parser logic directly)
-folder_dir = '/home/phucuy2025/HRS_Project/Content-Creator/content'
-folder_dir_2 = '/home/phucuy2025/HRS_Project/Content-Creator/content_2'
-folder_lst = [folder_dir, folder_dir_2]
 def processed_odt_file(odt_file_bytes):
-    my_dicts = []
-    line_lst = read_odt_file(odt_file_bytes=odt_file_bytes)
-    parsed_data_odt_simulated = parse_quiz_lines(line_lst)
-    my_dict=parsed_data_odt_simulated[0]
-    my_dicts.append(my_dict)
-    # for key, value in my_dict.items():
-    #     print(f"{key}, : {value}")
-    return my_dicts
+    return processed_file(odt_file_bytes, '.odt')
+
+# Number of write operations sent to MongoDB per bulk_write call.
+BULK_BATCH_SIZE = 500
+
+# Fields that are only written when a heritage's quiz document is first created.
+# Re-uploading a file refreshes the quiz content but keeps its _id, creation
+# time and the runtime data (stats, leaderboard, publication status).
+INSERT_ONLY_FIELDS = ('_id', 'createdAt', 'topPerformersLimit', 'stats', 'topPerformers', 'status')
+
+# Process-wide client and collection, created once by init_db() and shared by
+# every request. MongoClient is thread-safe and keeps its own connection pool.
+_client = None
+_collection = None
+
+
+def init_db(collection=None):
+    """
+    Creates the shared MongoClient and makes sure the indexes the upload path
+    relies on exist. Called once from main.lifespan.
+
+    Args:
+        collection: Optional collection-like object to use instead of a real
+                    MongoDB connection (e.g. an in-process fake for tests).
+    """
+    global _client, _collection
+    if collection is not None:
+        _collection = collection
+    else:
+        from pymongo import MongoClient
+        _client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        _collection = _client[MONGO_TEST_DB][MONGO_TEST_COLLECTION]
+    logger.info(f"Using database '{MONGO_TEST_DB}' and collection '{MONGO_TEST_COLLECTION}'")
+    ensure_indexes(_collection)
+    return _collection
+
 
-def insert_to_db(my_dicts):
+def close_db():
+    """Closes the shared MongoClient. Called once when the server shuts down."""
+    global _client, _collection
+    if _client:
+        _client.close()
+        logger.info("MongoDB client connection closed.")
+    _client = None
+    _collection = None
 
-    client = None
 
-    print(f"Attempting to connect to MongoDB at: {MONGO_URI}")
+def get_collection():
+    """Returns the shared quiz collection, creating the client on first use."""
+    if _collection is None:
+        init_db()
+    return _collection
 
+
+def ensure_indexes(collection):
+    """Creates the index used to upsert quizzes by heritageId, and the one the search index catches up with."""
+    from pymongo.errors import OperationFailure, PyMongoError
+
+    try:
+        collection.create_index("heritageId", unique=True, name="heritageId_unique")
+    except OperationFailure as e:
+        # Collections filled by older versions of the uploader may already hold
+        # several quizzes per heritageId; keep the lookup fast without the constraint.
+        logger.warning(f"Could not create unique heritageId index, falling back to a plain index. Details: {e}")
+        collection.create_index("heritageId")
+    except PyMongoError as e:
+        logger.warning(f"Could not create indexes on '{MONGO_TEST_COLLECTION}'. Details: {e}")
+        return
     try:
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ismaster')
-        print("MongoDB connection successful!")
+        collection.create_index("updatedAt", name="updatedAt")
+    except PyMongoError as e:
+        logger.warning(f"Could not create indexes on '{MONGO_TEST_COLLECTION}'. Details: {e}")
+
+
+# Fields returned by the read API: the quiz page needs the questions, the list only a summary
+QUIZ_READ_PROJECTION = {"_id": 1, "heritageId": 1, "title": 1, "content": 1, "questions": 1,
+                        "status": 1, "updatedAt": 1}
+QUIZ_LIST_PROJECTION = {"_id": 1, "heritageId": 1, "title": 1, "status": 1, "updatedAt": 1}
+
+
+def find_quiz(heritage_id, collection=None):
+    """Returns the quiz of one heritage with only the fields the quiz page needs, or None."""
+    if collection is None:
+        collection = get_collection()
+    with stage("db_read"):
+        return collection.find_one({"heritageId": heritage_id}, QUIZ_READ_PROJECTION)
+
 
-        db = client[MONGO_TEST_DB]
-        collection = db[MONGO_TEST_COLLECTION]
-        print(f"Using database '{MONGO_TEST_DB}' and collection '{MONGO_TEST_COLLECTION}'")
+def list_quizzes(skip=0, limit=20, collection=None):
+    """Returns (total, quiz summaries) for one page of quizzes ordered by heritageId."""
+    if collection is None:
+        collection = get_collection()
+    with stage("db_read"):
+        total = collection.count_documents({})
+        quizzes = list(collection.find({}, QUIZ_LIST_PROJECTION).sort("heritageId", 1).skip(skip).limit(limit))
+    return total, quizzes
 
-        for dt in my_dicts:
-            test_document = dt
 
-            print(f"\nAttempting to insert document with _id: {test_document['_id']}")
-            insert_result = collection.insert_one(test_document)
-            print(f"Insert successful! Inserted ID: {insert_result.inserted_id}")
-            inserted_doc_id = insert_result.inserted_id
+def build_upsert(quiz):
+    """Builds the idempotent write for one parsed quiz, keyed by its heritageId."""
+    from pymongo import UpdateOne
 
+    set_fields = {key: value for key, value in quiz.items() if key not in INSERT_ONLY_FIELDS}
+    insert_fields = {key: quiz[key] for key in INSERT_ONLY_FIELDS if key in quiz}
+    return UpdateOne(
+        {"heritageId": quiz["heritageId"]},
+        {"$set": set_fields, "$setOnInsert": insert_fields},
+        upsert=True,
+    )
+
+
+def bulk_upsert(collection, my_dicts):
+    """
+    Upserts the parsed quizzes with ordered bulk writes (one round trip per
+    BULK_BATCH_SIZE quizzes). Quizzes that already existed keep their stored
+    _id, which is copied back onto the given dictionaries. Raises on errors.
+    """
+    for start in range(0, len(my_dicts), BULK_BATCH_SIZE):
+        batch = my_dicts[start:start + BULK_BATCH_SIZE]
+        result = collection.bulk_write([build_upsert(dt) for dt in batch], ordered=True)
+        logger.debug(f"Bulk write successful! Upserted: {result.upserted_count}, updated: {result.modified_count}")
+
+        # Quizzes that were updated rather than inserted keep the _id stored in the database
+        updated = [dt for index, dt in enumerate(batch) if index not in result.upserted_ids]
+        if updated:
+            stored_ids = {
+                doc["heritageId"]: doc["_id"]
+                for doc in collection.find(
+                    {"heritageId": {"$in": [dt["heritageId"] for dt in updated]}},
+                    {"heritageId": 1},
+                )
+            }
+            for dt in updated:
+                dt["_id"] = stored_ids.get(dt["heritageId"], dt["_id"])
+
+
+def insert_to_db(my_dicts, collection=None):
+    """
+    Writes the parsed quizzes with bulk_upsert, reporting database errors.
+    Errors are re-raised after being reported, so callers never mistake a
+    failed write for a successful one. The API does not call this directly:
+    uploads go through the write-behind journal (journal.py).
+
+    This is blocking I/O: call it from a worker thread, not the event loop.
+    """
+    if not my_dicts:
+        return
+    if collection is None:
+        collection = get_collection()
+
+    from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+
+    try:
+        with stage("db_write"):
+            bulk_upsert(collection, my_dicts)
 
     except ConnectionFailure as e:
-        print(f"\nError: Could not connect to MongoDB. Please check your MONGO_URI and network settings. Details: {e}")
+        logger.error(f"Could not connect to MongoDB. Please check your MONGO_URI and network settings. Details: {e}")
+        raise
     except OperationFailure as e:
-        print(f"\nError: MongoDB operation failed. This might be due to authentication or permissions (e.g., user, database, collection permissions). Details: {e}")
+        logger.error(f"MongoDB operation failed. This might be due to authentication or permissions (e.g., user, database, collection permissions). Details: {e}")
+        raise
     except PyMongoError as e:
-        print(f"\nAn unexpected PyMongo error occurred: {e}")
+        logger.error(f"An unexpected PyMongo error occurred: {e}")
+        raise
     except Exception as e:
-        print(f"\nAn unexpected error occurred during test operations: {e}")
-
-    finally:
-        if client:
-            client.close()
-            print("\nMongoDB client connection closed.")
\ No newline at end of file
+        logger.error(f"An unexpected error occurred during test operations: {e}")
+        raise
@@ -0,0 +1,407 @@
+"""
+Near-duplicate detection across the whole question bank.
+
+Every stored question (content plus option texts) is segmented with
+underthesea (parser.tokenize_text) and hashed into a sparse TF-IDF row with
+scikit-learn's HashingVectorizer, which needs no vocabulary and therefore
+supports incremental updates. Document frequencies are maintained as a
+NumPy array. "Similar questions to X" is one sparse matrix-vector product;
+the full-bank duplicate report uses MinHash LSH signatures (computed as
+questions are added) to find candidate pairs and scores only those, so
+neither needs pairwise Python loops over the bank.
+
+Queries read an immutable snapshot of the weighted matrix. Uploads append
+their rows to it (weighted with the snapshot's IDF) and mask the rows they
+replace; the full rebuild, which refreshes the IDF and drops dead rows, runs
+in a background thread once enough of the bank has changed.
+"""
+import threading
+
+import numpy as np
+
+from parser import OPTION_PREFIX, tokenize_text
+
+N_FEATURES = 2 ** 20
+# MinHash LSH used to find candidate pairs for the full-bank duplicate report.
+# 16 bands of 4 hashes make pairs with a token Jaccard similarity around 0.5
+# and above very likely to share a band.
+MINHASH_BANDS = 16
+MINHASH_ROWS_PER_BAND = 4
+MINHASH_EMPTY = np.uint64(np.iinfo(np.uint64).max)
+# Buckets larger than this (boilerplate questions) are skipped to bound the pair count
+MAX_BUCKET_SIZE = 1000
+# Share of the snapshot's rows added or removed since the last rebuild that triggers a new one
+REBUILD_CHANGE_RATIO = 0.1
+_minhash_rng = np.random.default_rng(20250101)
+# Multiply-shift hashing: h(x) = ((a * x + b) mod 2**64) >> 32 with odd `a`
+MINHASH_A = _minhash_rng.integers(0, 1 << 63, size=MINHASH_BANDS * MINHASH_ROWS_PER_BAND, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+MINHASH_B = _minhash_rng.integers(0, 1 << 63, size=MINHASH_BANDS * MINHASH_ROWS_PER_BAND, dtype=np.uint64)
+
+
+def minhash_signature(feature_indices):
+    """MinHash signature of a set of hashed feature indices (uint64 array, one value per hash)."""
+    if len(feature_indices) == 0:
+        return np.full(MINHASH_BANDS * MINHASH_ROWS_PER_BAND, MINHASH_EMPTY, dtype=np.uint64)
+    x = feature_indices.astype(np.uint64)
+    with np.errstate(over="ignore"):
+        hashed = (MINHASH_A[:, None] * x[None, :] + MINHASH_B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1)
+
+
+def question_text(question):
+    """Text compared for duplicates: the question content followed by its option texts."""
+    options = " ".join(OPTION_PREFIX.sub("", option.get("optionText", "")) for option in question.get("options", []))
+    return f"{question.get('content', '')} {options}"
+
+
+def analyze(text):
+    """Word unigrams and bigrams of the segmented text."""
+    tokens = tokenize_text(text)
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+class IndexSnapshot:
+    """
+    Immutable view of the index that queries read: the L2-normalized TF-IDF
+    matrix with the entries, MinHash signatures and questionId -> row mapping
+    of the same rows. Rows replaced since the last rebuild are masked in `live`.
+    """
+    __slots__ = ("matrix", "entries", "idf", "signatures", "row_by_question", "live")
+
+    def __init__(self, matrix, entries, idf, signatures, row_by_question, live):
+        self.matrix = matrix
+        self.entries = entries
+        self.idf = idf
+        self.signatures = signatures
+        self.row_by_question = row_by_question
+        self.live = live
+
+
+class DuplicateIndex:
+    """
+    Incrementally updated TF-IDF index of quiz questions.
+
+    Rows are appended as questions arrive; a re-uploaded heritage first has its
+    old rows marked dead. Dead rows are dropped when the matrix is rebuilt.
+    """
+
+    def __init__(self, n_features=N_FEATURES):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.vectorizer = HashingVectorizer(analyzer=analyze, n_features=n_features,
+                                            alternate_sign=False, norm=None)
+        self.n_features = n_features
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()  # one rebuild at a time
+        self._rows = []            # raw term-frequency rows (csr_matrix 1 x n_features), None when dead
+        self._signatures = []      # MinHash signature per row, None when dead
+        self._entries = []         # per row: {"questionId", "heritageId", "content"}, None when dead
+        self._rows_by_heritage = {}
+        self._row_by_question = {}
+        self._df = np.zeros(n_features, dtype=np.int32)
+        self._alive = 0
+        self._snapshot = None      # IndexSnapshot served to queries
+        self._changes = 0          # rows added or removed since the snapshot was last rebuilt
+        self._deltas = None        # changes made while a rebuild runs, replayed onto its result
+        self._rebuild_thread = None
+        self._loading = False
+        self._early = []           # uploads indexed while load_from_collection runs
+
+    def __len__(self):
+        return self._alive
+
+    # --- Updates ---
+
+    def add_quizzes(self, quizzes):
+        """Indexes the questions of `quizzes`, replacing earlier versions of the same heritages."""
+        with self._lock:
+            if self._loading:
+                self._early.extend(quizzes)
+        self._index(quizzes)
+
+    def _index(self, quizzes):
+        prepared = []
+        for quiz in quizzes:
+            questions = quiz.get("questions", [])
+            matrix = self.vectorizer.transform([question_text(q) for q in questions]) if questions else None
+            prepared.append((quiz, questions, matrix))
+
+        with self._lock:
+            deltas = []
+            for quiz, questions, matrix in prepared:
+                removed = self._remove_heritage(quiz["heritageId"])
+                rows = []
+                added_rows, added_entries, added_signatures = [], [], []
+                for index, question in enumerate(questions):
+                    row = matrix[index]
+                    entry = {
+                        "questionId": str(question["questionId"]),
+                        "heritageId": quiz["heritageId"],
+                        "content": question.get("content", ""),
+                    }
+                    signature = minhash_signature(row.indices)
+                    self._rows.append(row)
+                    self._signatures.append(signature)
+                    self._entries.append(entry)
+                    self._df[row.indices] += 1
+                    self._row_by_question[entry["questionId"]] = len(self._rows) - 1
+                    rows.append(len(self._rows) - 1)
+                    self._alive += 1
+                    added_rows.append(row)
+                    added_entries.append(entry)
+                    added_signatures.append(signature)
+                self._rows_by_heritage[quiz["heritageId"]] = rows
+                deltas.append((removed, added_rows, added_entries, added_signatures))
+
+            if self._deltas is not None:
+                self._deltas.extend(deltas)
+            if self._snapshot is not None:
+                self._snapshot = self._extend_snapshot(self._snapshot, deltas)
+                self._changes += sum(len(removed) + len(rows) for removed, rows, _entries, _signatures in deltas)
+                if self._changes >= REBUILD_CHANGE_RATIO * max(self._snapshot.matrix.shape[0], 1):
+                    self._schedule_rebuild()
+
+    def _remove_heritage(self, heritage_id):
+        """Marks the rows of a heritage dead. Returns the questionIds removed."""
+        removed = []
+        for row_index in self._rows_by_heritage.pop(heritage_id, []):
+            row = self._rows[row_index]
+            if row is None:
+                continue
+            self._df[row.indices] -= 1
+            question_id = self._entries[row_index]["questionId"]
+            self._row_by_question.pop(question_id, None)
+            removed.append(question_id)
+            self._rows[row_index] = None
+            self._signatures[row_index] = None
+            self._entries[row_index] = None
+            self._alive -= 1
+        return removed
+
+    def load_from_collection(self, collection, batch_size=500):
+        """
+        (Re)builds the index from every quiz stored in `collection`. Uploads
+        indexed in the meantime are re-applied on top, as the cursor may
+        return the version they replaced.
+        """
+        with self._lock:
+            self._loading = True
+        try:
+            batch = []
+            for quiz in collection.find({}, {"heritageId": 1, "questions": 1}):
+                batch.append(quiz)
+                if len(batch) >= batch_size:
+                    self._index(batch)
+                    batch = []
+            self._index(batch)
+        finally:
+            with self._lock:
+                early, self._early = self._early, []
+                self._loading = False
+        self._index(early)
+        # Build the snapshot here (on the loading thread) rather than in the first query
+        with self._rebuild_lock:
+            self._rebuild()
+
+    # --- Snapshots ---
+
+    def _idf(self, document_count):
+        return np.log((1 + document_count) / (1 + self._df)) + 1.0
+
+    @staticmethod
+    def _normalize(matrix):
+        from sklearn.preprocessing import normalize
+        return normalize(matrix, norm="l2", copy=False)
+
+    def _compact(self):
+        # Called with the lock held: drops dead rows and renumbers the live ones
+        live = [i for i, row in enumerate(self._rows) if row is not None]
+        self._rows = [self._rows[i] for i in live]
+        self._signatures = [self._signatures[i] for i in live]
+        self._entries = [self._entries[i] for i in live]
+        self._row_by_question = {entry["questionId"]: i for i, entry in enumerate(self._entries)}
+        remap = {old: new for new, old in enumerate(live)}
+        self._rows_by_heritage = {
+            heritage_id: [remap[i] for i in rows if i in remap]
+            for heritage_id, rows in self._rows_by_heritage.items()
+        }
+
+    def _rebuild(self):
+        """
+        Rebuilds the snapshot from the live rows with a fresh IDF. The weighting
+        runs outside the lock; changes made meanwhile are replayed onto the result.
+        Called with _rebuild_lock held.
+        """
+        import scipy.sparse as sp
+
+        with self._lock:
+            self._compact()
+            rows, entries, signatures = list(self._rows), list(self._entries), list(self._signatures)
+            idf = self._idf(len(rows))
+            self._changes = 0
+            self._deltas = []
+
+        if rows:
+            matrix = self._normalize(sp.vstack(rows, format="csr") @ sp.diags(idf))
+        else:
+            matrix = sp.csr_matrix((0, self.n_features))
+        snapshot = IndexSnapshot(
+            matrix=matrix,
+            entries=entries,
+            idf=idf,
+            signatures=(np.vstack(signatures) if signatures
+                        else np.empty((0, MINHASH_BANDS * MINHASH_ROWS_PER_BAND), dtype=np.uint64)),
+            row_by_question={entry["questionId"]: i for i, entry in enumerate(entries)},
+            live=np.ones(len(rows), dtype=bool),
+        )
+
+        with self._lock:
+            deltas, self._deltas = self._deltas, None
+            if deltas:
+                snapshot = self._extend_snapshot(snapshot, deltas)
+            self._snapshot = snapshot
+        return snapshot
+
+    def _extend_snapshot(self, snapshot, deltas):
+        """
+        Returns a new snapshot with the rows of `deltas` ((removed questionIds,
+        rows, entries, signatures) per heritage) applied: removed rows are masked
+        and added rows are appended, weighted with the snapshot's IDF.
+        """
+        import scipy.sparse as sp
+
+        live = snapshot.live.copy()
+        row_by_question = dict(snapshot.row_by_question)
+        matrix, entries, signatures = snapshot.matrix, snapshot.entries, snapshot.signatures
+        added_rows, added_entries, added_signatures = [], [], []
+        for removed, rows, delta_entries, delta_signatures in deltas:
+            for question_id in removed:
+                row_index = row_by_question.pop(question_id, None)
+                if row_index is not None:
+                    if row_index < len(live):
+                        live[row_index] = False
+                    else:
+                        # Added earlier in this same batch of deltas
+                        added_entries[row_index - len(live)] = None
+            for entry in delta_entries:
+                row_by_question[entry["questionId"]] = len(live) + len(added_entries)
+                added_entries.append(entry)
+            added_rows.extend(rows)
+            added_signatures.extend(delta_signatures)
+
+        if added_rows:
+            weighted = self._normalize(sp.vstack(added_rows, format="csr") @ sp.diags(snapshot.idf))
+            matrix = sp.vstack([matrix, weighted], format="csr")
+            entries = entries + added_entries
+            signatures = np.vstack([signatures, np.vstack(added_signatures)])
+            live = np.concatenate([live, np.array([entry is not None for entry in added_entries], dtype=bool)])
+        return IndexSnapshot(matrix, entries, snapshot.idf, signatures, row_by_question, live)
+
+    def _schedule_rebuild(self):
+        # Called with the lock held
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        self._rebuild_thread = threading.Thread(target=self._rebuild_in_background,
+                                                name="duplicate-index-rebuild", daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild_in_background(self):
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def _current(self):
+        """Returns the snapshot queries should read, building the first one if needed."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._rebuild_lock:
+                snapshot = self._snapshot or self._rebuild()
+        return snapshot
+
+    # --- Queries ---
+
+    def similar(self, text=None, question_id=None, limit=10, min_score=0.3):
+        """
+        Returns the questions most similar to `text`, or to the stored question
+        `question_id`, as dicts with questionId, heritageId, content and score.
+        """
+        import scipy.sparse as sp
+
+        snapshot = self._current()
+        matrix = snapshot.matrix
+        exclude = None
+        if question_id is not None:
+            # Looked up in the same snapshot as the matrix, so the row always belongs to it
+            row_index = snapshot.row_by_question.get(str(question_id))
+            if row_index is None:
+                raise KeyError(question_id)
+            query = matrix[row_index]
+            exclude = row_index
+        else:
+            query = self._normalize(self.vectorizer.transform([text or ""]) @ sp.diags(snapshot.idf))
+
+        scores = (matrix @ query.T).toarray().ravel()
+        scores[~snapshot.live] = 0.0
+        if exclude is not None:
+            scores[exclude] = 0.0
+        candidates = np.flatnonzero(scores >= min_score)
+        best = candidates[np.argsort(-scores[candidates], kind="stable")][:limit]
+        return [dict(snapshot.entries[i], score=round(float(scores[i]), 4)) for i in best]
+
+    def duplicates(self, threshold=0.8, limit=1000):
+        """
+        Full-bank report of question pairs whose cosine similarity is at least
+        `threshold`, most similar first.
+
+        Candidate pairs come from MinHash locality-sensitive hashing: questions
+        whose signatures agree on a whole band land in the same bucket. Only
+        those candidates are scored exactly against the TF-IDF matrix, so the
+        cost grows with the number of near-duplicates rather than with N².
+        """
+        snapshot = self._current()
+        matrix, entries = snapshot.matrix, snapshot.entries
+        count = matrix.shape[0]
+        if count < 2:
+            return []
+
+        rows, cols = self._candidate_pairs(snapshot.signatures)
+        live = snapshot.live[rows] & snapshot.live[cols]
+        rows, cols = rows[live], cols[live]
+        pairs = []
+        for start in range(0, len(rows), 100_000):
+            chunk_rows, chunk_cols = rows[start:start + 100_000], cols[start:start + 100_000]
+            scores = np.asarray(matrix[chunk_rows].multiply(matrix[chunk_cols]).sum(axis=1)).ravel()
+            keep = scores >= threshold
+            pairs.extend(zip(scores[keep].tolist(), chunk_rows[keep].tolist(), chunk_cols[keep].tolist()))
+
+        pairs.sort(key=lambda pair: -pair[0])
+        return [
+            {"score": round(score, 4), "first": entries[row], "second": entries[col]}
+            for score, row, col in pairs[:limit]
+        ]
+
+    @staticmethod
+    def _candidate_pairs(signatures):
+        """Returns (rows, cols) arrays of row pairs (row < col) sharing at least one MinHash band."""
+        count = signatures.shape[0]
+        found = []
+        band_weights = np.arange(1, MINHASH_ROWS_PER_BAND + 1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        has_features = signatures[:, 0] != MINHASH_EMPTY
+        for band in range(MINHASH_BANDS):
+            columns = signatures[:, band * MINHASH_ROWS_PER_BAND:(band + 1) * MINHASH_ROWS_PER_BAND]
+            with np.errstate(over="ignore"):
+                keys = (columns * band_weights).sum(axis=1)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            # Only buckets with two or more members can produce pairs
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            sizes = np.diff(np.r_[starts, count])
+            for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+                bucket = np.sort(order[start:start + size])
+                if size > MAX_BUCKET_SIZE or not has_features[bucket[0]]:
+                    continue
+                first, second = np.triu_indices(size, k=1)
+                found.append(bucket[first] * count + bucket[second])
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pairs = np.unique(np.concatenate(found))
+        return pairs // count, pairs % count
@@ -0,0 +1,187 @@
+"""
+Static export of quizzes for a CDN or static host.
+
+Writes one compressed JSON bundle per heritageId, named after a hash of its
+content, plus an index manifest (index.json) mapping every heritageId to its
+bundle. Bundle files never change once written, so they can be cached
+forever; only index.json has to be revalidated.
+
+Builds are incremental: a bundle is only rewritten when the content hash of
+its quiz changed, and bundles of changed or removed quizzes are deleted
+after the new index is in place.
+
+Bundles hold the same JSON as GET /quizzes/{heritageId}. They are always
+gzip-compressed (.json.gz); with --brotli and the optional `brotli` package
+installed, a .json.br copy is written next to each one.
+
+Usage:
+    python export.py                                  # from MongoDB into exports/
+    python export.py --output-dir public/quizzes --brotli
+    python export.py --from-dir content/ content_2/   # parse documents, no database
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import settings
+from responses import dumps_quiz
+
+EXPORT_DIR = settings.get_str("EXPORT_DIR", "exports")
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+# Length of the content hash embedded in bundle filenames
+HASH_LENGTH = 16
+
+
+def write_atomic(path, data):
+    """Writes `data` to `path` through a temporary file, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_index(output_dir):
+    """Returns the existing index manifest, or an empty one."""
+    try:
+        with open(os.path.join(output_dir, INDEX_FILENAME), encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {"version": INDEX_VERSION, "quizzes": {}}
+    if index.get("version") != INDEX_VERSION:
+        return {"version": INDEX_VERSION, "quizzes": {}}
+    return index
+
+
+def bundle_name(heritage_id, digest):
+    # heritageIds are ObjectId strings, but keep the filename safe whatever they contain
+    safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(heritage_id))
+    return f"{safe_id}.{digest[:HASH_LENGTH]}.json"
+
+
+def quizzes_from_db():
+    """Yields every stored quiz with the fields served by the read API."""
+    from db import QUIZ_READ_PROJECTION, get_collection
+    yield from get_collection().find({}, QUIZ_READ_PROJECTION).sort("heritageId", 1)
+
+
+def quizzes_from_directories(directories):
+    """
+    Yields the quizzes parsed from the documents in `directories` (without a
+    database). Parsing goes through the parse cache, so an unchanged document
+    keeps its ids and timestamps, and therefore its bundle, between runs.
+    """
+    from db import QUIZ_READ_PROJECTION, processed_file
+    from ingest import find_quiz_files
+
+    for path in find_quiz_files(directories):
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        for quiz in processed_file(file_bytes, os.path.splitext(path)[1].lower()):
+            yield {key: value for key, value in quiz.items() if key in QUIZ_READ_PROJECTION}
+
+
+def export_quizzes(quizzes, output_dir=EXPORT_DIR, use_brotli=False):
+    """
+    Writes the bundles and index manifest for `quizzes`.
+
+    Returns:
+        A summary dictionary with written/unchanged/removed counts.
+    """
+    brotli = None
+    if use_brotli:
+        try:
+            import brotli
+        except ImportError:
+            print("Warning: the 'brotli' package is not installed, writing gzip bundles only.", file=sys.stderr)
+
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_index(output_dir)["quizzes"]
+    entries = {}
+    written = unchanged = 0
+
+    for quiz in quizzes:
+        heritage_id = str(quiz["heritageId"])
+        body = dumps_quiz(quiz)
+        digest = hashlib.sha256(body).hexdigest()
+        name = bundle_name(heritage_id, digest)
+        entry = {
+            "hash": digest,
+            "gzip": name + ".gz",
+            "title": quiz.get("title", ""),
+            "questions": len(quiz.get("questions", [])),
+            "updatedAt": quiz.get("updatedAt"),
+            "bytes": len(body),
+        }
+        if brotli is not None:
+            entry["brotli"] = name + ".br"
+
+        old = previous.get(heritage_id)
+        files = [entry["gzip"]] + ([entry["brotli"]] if "brotli" in entry else [])
+        if (old and all(old.get(key) == entry.get(key) for key in ("hash", "gzip", "brotli"))
+                and all(os.path.exists(os.path.join(output_dir, filename)) for filename in files)):
+            unchanged += 1
+        else:
+            # mtime=0 keeps the gzip bytes a pure function of the content
+            write_atomic(os.path.join(output_dir, entry["gzip"]), gzip.compress(body, compresslevel=9, mtime=0))
+            if brotli is not None:
+                write_atomic(os.path.join(output_dir, entry["brotli"]), brotli.compress(body))
+            written += 1
+        entries[heritage_id] = entry
+
+    index = {"version": INDEX_VERSION, "generatedAt": int(time.time()), "quizzes": entries}
+    write_atomic(os.path.join(output_dir, INDEX_FILENAME),
+                 json.dumps(index, ensure_ascii=False, indent=1, sort_keys=True).encode("utf-8"))
+
+    # Only now that the new index is in place, delete the bundles it no longer references
+    current_files = {entry[key] for entry in entries.values() for key in ("gzip", "brotli") if key in entry}
+    removed = 0
+    for old in previous.values():
+        for key in ("gzip", "brotli"):
+            filename = old.get(key)
+            if filename and filename not in current_files:
+                try:
+                    os.unlink(os.path.join(output_dir, filename))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+
+    return {
+        "quizzes": len(entries),
+        "written": written,
+        "unchanged": unchanged,
+        "removedFiles": removed,
+        "deletedQuizzes": len(set(previous) - set(entries)),
+        "outputDir": output_dir,
+    }
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Export quizzes as compressed, content-hashed JSON bundles.")
+    arg_parser.add_argument("--output-dir", default=EXPORT_DIR, help=f"Where to write the bundles (default: {EXPORT_DIR})")
+    arg_parser.add_argument("--from-dir", nargs="+", metavar="DIRECTORY",
+                            help="Parse the quiz documents in these directories instead of reading MongoDB")
+    arg_parser.add_argument("--brotli", action="store_true", help="Also write .json.br bundles (needs the brotli package)")
+    args = arg_parser.parse_args(argv)
+
+    quizzes = quizzes_from_directories(args.from_dir) if args.from_dir else quizzes_from_db()
+    started = time.perf_counter()
+    summary = export_quizzes(quizzes, args.output_dir, use_brotli=args.brotli)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {summary['quizzes']} quizzes to {summary['outputDir']} in {elapsed:.2f}s: "
+          f"{summary['written']} written, {summary['unchanged']} unchanged, "
+          f"{summary['deletedQuizzes']} deleted ({summary['removedFiles']} stale files removed)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Batch ingestion of quiz documents from whole content directories.
+
+Reading and parsing (the CPU-bound part) is fanned out over a process pool
+sized to the machine, and the parsed quizzes are written to MongoDB in bulk
+batches from the main process. Workers return the compact models.Quiz
+objects, which are only converted to documents right before each write.
+
+Usage:
+    python ingest.py content/ content_2/ content_3/
+    python ingest.py content/ --workers 4 --batch-size 200 --dry-run
+    python ingest.py content/ content_2/ --incremental .ingest_manifest.json
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from parser import FILE_READERS, read_quiz_file, parse_quiz_models
+
+
+def find_quiz_files(directories):
+    """Returns the sorted paths of every supported quiz file under the given directories."""
+    paths = []
+    for directory in directories:
+        for root, _dirs, filenames in os.walk(directory):
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in FILE_READERS:
+                    paths.append(os.path.join(root, filename))
+    return sorted(paths)
+
+
+def parse_path(path):
+    """
+    Reads and parses one file. Runs inside a worker process.
+
+    Returns:
+        A (path, quizzes, error) tuple of models.Quiz objects; `error` is None on success.
+    """
+    try:
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        file_extension = os.path.splitext(path)[1].lower()
+        return path, list(parse_quiz_models(read_quiz_file(file_bytes, file_extension))), None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+
+def ingest_directories(directories, workers=None, batch_size=500, dry_run=False, manifest_path=None):
+    """
+    Parses every quiz file in `directories` in parallel and writes the quizzes
+    to the database in batches of `batch_size`.
+
+    With `manifest_path`, runs an incremental sync instead: only files whose
+    content changed since the last run are parsed, and their quizzes are
+    diffed against the stored ones question by question (see sync.py).
+
+    Returns:
+        A summary dictionary with counts, elapsed time and throughput.
+    """
+    all_paths = find_quiz_files(directories)
+    paths = all_paths
+    workers = workers or os.cpu_count() or 1
+    pending = []
+    failures = []
+    files_done = 0
+    quizzes_done = 0
+    questions_done = 0
+    sync_totals = {}
+    manifest = None
+
+    if manifest_path:
+        from sync import FileManifest
+        manifest = FileManifest(manifest_path)
+        paths = manifest.changed(all_paths)
+
+    if not dry_run:
+        # Imported here so --dry-run works without pymongo or a database
+        from db import insert_to_db
+        if manifest:
+            from sync import sync_quizzes
+
+    def write(models):
+        quizzes = [quiz.to_dict() for quiz in models]
+        if manifest:
+            for key, value in sync_quizzes(quizzes).items():
+                sync_totals[key] = sync_totals.get(key, 0) + value
+        else:
+            insert_to_db(quizzes)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse_path, path) for path in paths]
+        for future in as_completed(futures):
+            path, quizzes, error = future.result()
+            if error:
+                failures.append({"path": path, "error": error})
+                print(f"Failed: {path}: {error}", file=sys.stderr)
+                continue
+            if manifest:
+                manifest.record(path)
+            files_done += 1
+            quizzes_done += len(quizzes)
+            questions_done += sum(len(quiz.questions) for quiz in quizzes)
+            if not dry_run:
+                pending.extend(quizzes)
+            if len(pending) >= batch_size and not dry_run:
+                write(pending)
+                pending = []
+
+    if pending and not dry_run:
+        write(pending)
+    elapsed = time.perf_counter() - started
+
+    if manifest and not dry_run:
+        manifest.forget_missing(all_paths)
+        manifest.save()
+
+    return {
+        "files": len(paths),
+        "filesUnchanged": len(all_paths) - len(paths),
+        "sync": sync_totals,
+        "filesParsed": files_done,
+        "quizzes": quizzes_done,
+        "questions": questions_done,
+        "failures": failures,
+        "workers": workers,
+        "elapsedSeconds": round(elapsed, 3),
+        "filesPerSecond": round(files_done / elapsed, 2) if elapsed else 0.0,
+        "quizzesPerSecond": round(quizzes_done / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def print_summary(summary):
+    print(f"Files: {summary['filesParsed']}/{summary['files']} parsed with {summary['workers']} workers "
+          f"in {summary['elapsedSeconds']}s")
+    print(f"Quizzes: {summary['quizzes']}, questions: {summary['questions']}")
+    if summary["filesUnchanged"]:
+        print(f"Unchanged files skipped: {summary['filesUnchanged']}")
+    if summary["sync"]:
+        print("Sync: " + ", ".join(f"{key}={value}" for key, value in summary["sync"].items()))
+    print(f"Throughput: {summary['filesPerSecond']} files/sec, {summary['quizzesPerSecond']} quizzes/sec")
+    print(f"Failures: {len(summary['failures'])}")
+    for failure in summary["failures"]:
+        print(f"  {failure['path']}: {failure['error']}")
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Parse quiz files from content directories and load them into MongoDB.")
+    arg_parser.add_argument("directories", nargs="+", help="Directories to scan for .odt, .docx and .txt quiz files")
+    arg_parser.add_argument("--workers", type=int, default=None, help="Number of parser processes (default: number of CPU cores)")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="Quizzes per bulk database write (default: 500)")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Parse only, do not write to the database")
+    arg_parser.add_argument("--incremental", metavar="MANIFEST",
+                            help="Only re-read files changed since the last run recorded in MANIFEST "
+                                 "(a JSON file) and apply question-level diffs")
+    args = arg_parser.parse_args(argv)
+
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            arg_parser.error(f"Not a directory: {directory}")
+
+    summary = ingest_directories(args.directories, args.workers, args.batch_size, args.dry_run, args.incremental)
+    print_summary(summary)
+    return 1 if summary["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Background jobs for batch uploads.
+
+A batch upload is turned into a job made of one task per file. The tasks run
+on a bounded thread pool, so the HTTP request returns a job id immediately and
+clients poll GET /jobs/{id} for per-file progress and results.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+
+JOB_WORKERS = settings.get_int("JOB_WORKERS", 4)
+# Finished jobs beyond this number are forgotten, oldest first
+MAX_JOBS = settings.get_int("MAX_JOBS", 1000)
+
+
+class JobManager:
+    """
+    Runs batch upload jobs on a bounded worker pool and keeps their status in memory.
+
+    Args:
+        process_file: Callable(filename, file_bytes) -> list of quiz dicts. Runs on a
+                      worker thread and may raise to mark the file as failed.
+        max_workers: Number of worker threads shared by all jobs.
+        max_jobs: Number of jobs whose status is retained.
+    """
+
+    def __init__(self, process_file, max_workers=JOB_WORKERS, max_jobs=MAX_JOBS):
+        self.process_file = process_file
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="upload-job")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, files):
+        """
+        Creates a job for `files`, a list of (filename, file_bytes) tuples, and
+        queues one task per file. Returns a snapshot of the new job.
+        """
+        self.start()
+        job_id = uuid.uuid4().hex
+        job = {
+            "jobId": job_id,
+            "status": "queued",
+            "createdAt": int(time.time()),
+            "finishedAt": None,
+            "total": len(files),
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "files": [
+                {"filename": filename, "status": "queued", "quizzes": [], "error": None}
+                for filename, _file_bytes in files
+            ],
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict_finished()
+            snapshot = copy.deepcopy(job)
+        for index, (filename, file_bytes) in enumerate(files):
+            self._executor.submit(self._run_file, job, index, filename, file_bytes)
+        if not files:
+            self._finish(job)
+        return snapshot
+
+    def get(self, job_id):
+        """Returns a snapshot of the job, or None if it is unknown (or was evicted)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def _run_file(self, job, index, filename, file_bytes):
+        entry = job["files"][index]
+        with self._lock:
+            entry["status"] = "processing"
+            if job["status"] == "queued":
+                job["status"] = "running"
+        try:
+            quizzes = self.process_file(filename, file_bytes)
+            result = [
+                {
+                    "_id": str(quiz["_id"]),
+                    "heritageId": quiz["heritageId"],
+                    "title": quiz["title"],
+                    "questionCount": len(quiz["questions"]),
+                }
+                for quiz in quizzes
+            ]
+            error = None
+        except Exception as e:
+            result = []
+            error = getattr(e, "detail", None) or str(e)
+
+        with self._lock:
+            entry["quizzes"] = result
+            entry["error"] = error
+            entry["status"] = "failed" if error else "done"
+            job["processed"] += 1
+            job["failed" if error else "succeeded"] += 1
+            done = job["processed"] == job["total"]
+        if done:
+            self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            job["status"] = "completed_with_errors" if job["failed"] else "completed"
+            job["finishedAt"] = int(time.time())
+
+    def _evict_finished(self):
+        # Called with the lock held. Running jobs are never evicted.
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]["finishedAt"] is not None:
+                del self._jobs[job_id]
+                excess -= 1
@@ -0,0 +1,464 @@
+"""
+Write-behind journal between the upload path and MongoDB.
+
+Uploads append their parsed quizzes to a local append-only file
+(QUIZ_JOURNAL_PATH, by default in settings.STATE_DIR rather than the working
+directory; one Extended JSON line per upload, fsync'd) and return
+without waiting for MongoDB. A background flusher thread reads the journal
+in order, writes it with db.bulk_upsert in batches and records how far it
+got in a checkpoint file (<journal>.offset).
+
+  * If MongoDB is slow, down or refusing writes (network errors, failovers,
+    authentication or permission failures...), the flusher retries with
+    exponential backoff for as long as it takes and the uploads keep
+    succeeding; nothing is lost.
+  * On startup, entries after the checkpoint are replayed. The upserts are
+    keyed by heritageId, so replaying an entry that was already written is
+    harmless.
+  * When MongoDB rejects a document itself (too large, failing validation...),
+    the batch is retried one entry at a time and only the entries MongoDB
+    rejects are moved to <journal>.failed, so they cannot block the entries
+    behind them. `python journal.py --requeue-failed` (or
+    QuizJournal.requeue_failed) puts them back on the journal once fixed.
+  * Once everything is flushed the journal is truncated.
+  * Re-uploading a heritage keeps the _id stored in MongoDB ($setOnInsert),
+    so append rewrites each quiz's _id to the stored one before journaling
+    it: looked up once per heritage with a projected find, then remembered
+    (including for quizzes still pending here), so callers always return
+    the _id the database has or will have.
+
+The lag (pending uploads and age of the oldest one) is exposed as metrics.
+The journal has a single writer process: start() takes an exclusive lock on
+the journal file and fails right away if another process already holds it.
+"""
+import fcntl
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+
+import settings
+from metrics import JOURNAL_FLUSHES, JOURNAL_LAG, JOURNAL_PENDING, stage
+
+logger = logging.getLogger(__name__)
+
+QUIZ_JOURNAL_PATH = settings.get_str("QUIZ_JOURNAL_PATH", os.path.join(settings.STATE_DIR, "quiz_journal.jsonl"))
+JOURNAL_BATCH_SIZE = settings.get_int("JOURNAL_BATCH_SIZE", 500)  # quizzes per bulk write
+JOURNAL_FLUSH_INTERVAL = settings.get_float("JOURNAL_FLUSH_INTERVAL", 1.0)  # seconds between idle checks
+JOURNAL_FSYNC = settings.get_int("JOURNAL_FSYNC", 1)  # 0 trades durability on power loss for latency
+JOURNAL_MAX_BACKOFF = settings.get_float("JOURNAL_MAX_BACKOFF", 30.0)
+
+
+def encode_entry(quizzes):
+    from bson import json_util
+    entry = {"ts": time.time(), "quizzes": quizzes}
+    return (json_util.dumps(entry, json_options=json_util.RELAXED_JSON_OPTIONS) + "\n").encode("utf-8")
+
+
+def decode_entry(line):
+    from bson import json_util
+    return json_util.loads(line.decode("utf-8"))
+
+
+def is_transient(error):
+    """True for errors expected to clear up on their own (network problems, failovers)."""
+    from pymongo.errors import ConnectionFailure, PyMongoError
+    if isinstance(error, ConnectionFailure):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+
+def is_document_error(error):
+    """
+    True when MongoDB rejected specific documents (too large, not encodable,
+    failing validation...) rather than the write as a whole. Retrying those
+    documents cannot succeed; every other error is retried.
+    """
+    from bson.errors import InvalidDocument
+    from pymongo.errors import BulkWriteError, DocumentTooLarge, WriteError
+
+    if isinstance(error, BulkWriteError):
+        return bool(error.details.get("writeErrors")) and not error.details.get("writeConcernErrors")
+    return isinstance(error, (DocumentTooLarge, InvalidDocument, WriteError))
+
+
+def default_id_resolver(heritage_ids):
+    """Returns {heritageId: _id} of the quizzes of `heritage_ids` already stored in MongoDB."""
+    from db import get_collection
+    with stage("db_read"):
+        return {
+            doc["heritageId"]: doc["_id"]
+            for doc in get_collection().find({"heritageId": {"$in": list(heritage_ids)}}, {"heritageId": 1})
+        }
+
+
+def default_writer(quizzes):
+    """Writes quizzes to the shared collection; raises on failure."""
+    from db import bulk_upsert, get_collection
+    with stage("db_write"):
+        bulk_upsert(get_collection(), quizzes)
+
+
+class QuizJournal:
+    """
+    Args:
+        path: The journal file.
+        writer: Callable writing a list of quizzes to the database, raising on failure.
+        on_flushed: Optional callable receiving the quizzes of every flushed batch.
+        id_resolver: Optional callable returning {heritageId: stored _id} for a set of
+                     heritageIds, used to give re-uploaded quizzes their stored _id.
+    """
+
+    def __init__(self, path=QUIZ_JOURNAL_PATH, writer=default_writer, on_flushed=None, id_resolver=default_id_resolver,
+                 batch_size=JOURNAL_BATCH_SIZE, flush_interval=JOURNAL_FLUSH_INTERVAL, fsync=JOURNAL_FSYNC):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.failed_path = path + ".failed"
+        self.writer = writer
+        self.on_flushed = on_flushed
+        self.id_resolver = id_resolver
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock_file = None      # open journal file holding the single-writer lock
+        self._offset = 0            # bytes of the journal already written to MongoDB
+        self._pending = deque()     # (end offset, timestamp) of every entry past _offset
+        self._stored_ids = {}       # heritageId -> _id the quiz has (or will have) in MongoDB
+        self._failing = False       # True while flushes fail: the database is not queried for ids then
+
+    # --- Lag ---
+
+    def pending(self):
+        return len(self._pending)
+
+    def lag_seconds(self):
+        try:
+            return round(time.time() - self._pending[0][1], 3)
+        except IndexError:
+            return 0.0
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """
+        Locks the journal, recovers its state and starts the flusher, which
+        replays pending entries first. Raises RuntimeError if another process
+        has the journal open.
+        """
+        self._acquire()
+        self._recover()
+        JOURNAL_PENDING.set_function(self.pending)
+        JOURNAL_LAG.set_function(self.lag_seconds)
+        if self._pending:
+            logger.info(f"Replaying {len(self._pending)} journal entries from {self.path}")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="journal-flusher", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=10.0):
+        """Stops the flusher after one last flush attempt; unflushed entries stay in the journal."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pending:
+            logger.warning(f"{len(self._pending)} journal entries not yet written to MongoDB, "
+                           f"they will be replayed at the next start")
+        self._release()
+
+    def _acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self._lock_file is not None:
+            return
+        lock_file = open(self.path, "ab")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(f"Journal {self.path} is in use by another process") from None
+        self._lock_file = lock_file
+
+    def _release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # closing the file releases the lock
+            self._lock_file = None
+
+    def _recover(self):
+        try:
+            with open(self.offset_path, encoding="utf-8") as f:
+                offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            offset = 0
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if offset > size:
+            # The journal was truncated after its checkpoint was written
+            offset = 0
+
+        pending = deque()
+        stored_ids = {}
+        end = offset
+        if size > offset:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partial entry from a crash during append; it was never acknowledged
+                    try:
+                        entry = decode_entry(line)
+                        timestamp = entry.get("ts", time.time())
+                        for quiz in entry["quizzes"]:
+                            stored_ids.setdefault(quiz["heritageId"], quiz["_id"])
+                    except Exception:
+                        timestamp = time.time()  # kept so the flusher moves it to the failed file
+                    end += len(line)
+                    pending.append((end, timestamp))
+            if end < size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(end)
+        with self._lock:
+            self._offset = offset
+            self._pending = pending
+            for heritage_id, stored_id in stored_ids.items():
+                self._stored_ids.setdefault(heritage_id, stored_id)
+
+    # --- Writes ---
+
+    def append(self, quizzes):
+        """
+        Durably appends one upload's quizzes, first giving each quiz the _id its
+        heritage has in MongoDB (updated in place). Raises OSError if the journal
+        cannot be written.
+        """
+        if not quizzes:
+            return
+        self._assign_stored_ids(quizzes)
+        line = encode_entry(quizzes)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                end = f.tell()
+            self._pending.append((end, time.time()))
+        self._wakeup.set()
+
+    def _assign_stored_ids(self, quizzes):
+        unknown = {quiz["heritageId"] for quiz in quizzes if quiz["heritageId"] not in self._stored_ids}
+        resolved = {}
+        if unknown and self.id_resolver is not None and not self._failing:
+            try:
+                resolved = self.id_resolver(unknown)
+            except Exception as e:
+                # The upload is still journaled; only its _id may differ from the stored one
+                logger.warning(f"Could not look up the stored _id of {len(unknown)} quizzes: {e}")
+                unknown = set()
+        else:
+            unknown = set()
+        with self._lock:
+            for heritage_id, stored_id in resolved.items():
+                self._stored_ids.setdefault(heritage_id, stored_id)
+            for quiz in quizzes:
+                heritage_id = quiz["heritageId"]
+                if heritage_id in self._stored_ids:
+                    quiz["_id"] = self._stored_ids[heritage_id]
+                elif heritage_id in unknown:
+                    # Confirmed absent from MongoDB: this quiz's _id is the one that gets inserted
+                    self._stored_ids[heritage_id] = quiz["_id"]
+
+    # --- Flusher ---
+
+    def _read_batch(self):
+        """
+        Returns the entries of the next batch, up to batch_size quizzes, as
+        (raw line, end offset, quizzes) tuples; quizzes is None for an
+        unreadable line. Returns an empty list when nothing is pending.
+        """
+        with self._lock:
+            if not self._pending:
+                return []
+            start = self._offset
+            limit = self._pending[-1][0]
+        entries, end, quiz_count = [], start, 0
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            while end < limit and quiz_count < self.batch_size:
+                line = f.readline()
+                end += len(line)
+                try:
+                    quizzes = decode_entry(line)["quizzes"]
+                    quiz_count += len(quizzes)
+                except Exception:
+                    quizzes = None
+                entries.append((line, end, quizzes))
+        return entries
+
+    def _advance(self, end, count):
+        with self._lock:
+            self._offset = end
+            for _ in range(count):
+                self._pending.popleft()
+            if not self._pending and os.path.getsize(self.path) == end:
+                # Everything is in MongoDB: start the journal over
+                with open(self.path, "r+b") as f:
+                    f.truncate(0)
+                self._offset = end = 0
+            self._write_checkpoint(end)
+
+    def _write_checkpoint(self, offset):
+        directory = os.path.dirname(os.path.abspath(self.offset_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def _dead_letter(self, lines):
+        with open(self.failed_path, "ab") as f:
+            f.writelines(lines)
+
+    def flush_once(self):
+        """Writes the next batch. Returns True if a batch was written, False if there was none. Raises on failure."""
+        entries = self._read_batch()
+        if not entries:
+            return False
+        quizzes = [quiz for _line, _end, entry_quizzes in entries if entry_quizzes for quiz in entry_quizzes]
+        if quizzes:
+            self.writer(quizzes)
+        self._written(entries, quizzes)
+        return True
+
+    def flush_entries_one_by_one(self):
+        """
+        Writes the next batch one entry at a time, after the whole batch was
+        rejected for a document error. Entries MongoDB rejects are moved to the
+        failed file; any other error is raised, keeping the progress made.
+        """
+        for entry in self._read_batch():
+            line, end, quizzes = entry
+            try:
+                if quizzes:
+                    self.writer(quizzes)
+            except Exception as e:
+                if not is_document_error(e):
+                    raise
+                logger.error(f"Journal entry of {len(quizzes)} quizzes rejected by MongoDB, "
+                             f"moved to {self.failed_path}: {e}")
+                self._dead_letter([line])
+                self._advance(end, 1)
+                JOURNAL_FLUSHES.inc(status="rejected")
+                continue
+            self._written([entry], quizzes or [])
+
+    def _written(self, entries, quizzes):
+        """Advances past `entries` once their quizzes are in MongoDB."""
+        self._advance(entries[-1][1], len(entries))
+        JOURNAL_FLUSHES.inc(status="ok")
+        unreadable = [line for line, _end, entry_quizzes in entries if entry_quizzes is None]
+        if unreadable:
+            logger.error(f"{len(unreadable)} unreadable journal entries moved to {self.failed_path}")
+            self._dead_letter(unreadable)
+        if self.on_flushed is not None and quizzes:
+            try:
+                self.on_flushed(quizzes)
+            except Exception as e:
+                logger.error(f"Journal on_flushed callback failed: {e}")
+
+    def requeue_failed(self):
+        """
+        Appends the entries of the failed file back to the journal, so the
+        flusher retries them, and removes the failed file. Returns the number
+        of entries requeued. Replaying an entry twice is harmless (upserts).
+        Raises RuntimeError if another process has the journal open.
+        """
+        started = self._lock_file is not None
+        self._acquire()
+        try:
+            return self._requeue_failed()
+        finally:
+            if not started:
+                self._release()
+
+    def _requeue_failed(self):
+        with self._lock:
+            try:
+                with open(self.failed_path, "rb") as f:
+                    lines = [line if line.endswith(b"\n") else line + b"\n" for line in f]
+            except FileNotFoundError:
+                return 0
+            with open(self.path, "ab") as f:
+                start = f.tell()
+                f.writelines(lines)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            now = time.time()
+            for line in lines:
+                start += len(line)
+                self._pending.append((start, now))
+            os.unlink(self.failed_path)
+        self._wakeup.set()
+        return len(lines)
+
+    def _run(self):
+        attempt = 0
+        while True:
+            stopping = self._stopping.is_set()
+            try:
+                try:
+                    while self.flush_once():
+                        attempt = 0
+                    self._failing = False
+                except Exception as e:
+                    if not is_document_error(e):
+                        raise
+                    JOURNAL_FLUSHES.inc(status="error")
+                    logger.warning(f"Journal batch rejected by MongoDB, retrying it entry by entry: {e}")
+                    self.flush_entries_one_by_one()
+                    attempt = 0
+                    continue
+            except Exception as e:
+                # MongoDB unreachable or refusing every write: nothing is dropped, keep retrying
+                self._failing = True
+                attempt += 1
+                JOURNAL_FLUSHES.inc(status="error")
+                delay = min(JOURNAL_MAX_BACKOFF, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                log = logger.warning if is_transient(e) else logger.error
+                log(f"Journal flush failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                if stopping:
+                    return
+                self._stopping.wait(delay)
+                continue
+            if stopping:
+                return
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+
+def main(argv=None):
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Maintenance of the write-behind upload journal.")
+    arg_parser.add_argument("--path", default=QUIZ_JOURNAL_PATH, help="Journal file (default: QUIZ_JOURNAL_PATH)")
+    arg_parser.add_argument("--requeue-failed", action="store_true",
+                            help="Move the entries of <journal>.failed back to the journal. Run it while the "
+                                 "API is stopped; they are written to MongoDB when it starts.")
+    args = arg_parser.parse_args(argv)
+
+    if args.requeue_failed:
+        count = QuizJournal(args.path).requeue_failed()
+        print(f"Requeued {count} entries from {args.path}.failed")
+    else:
+        arg_parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
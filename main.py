@@ -1,25 +1,59 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 import io
 import os
+import zipfile
 
 # Assuming your parser.py is in the same directory
-from parser import parse_quiz_lines, read_docx_file, read_odt_file, read_txt_file
-from db import processed_odt_file, insert_to_db
+from parser import FILE_READERS
+from db import (processed_file, init_db, close_db, get_collection, parse_file_bytes,
+                find_quiz, list_quizzes)
+from offload import MAX_UPLOAD_BYTES, ParseOffloader, UploadLimitMiddleware
+from jobs import JobManager
+from responses import QuizJSONResponse, QuizNDJSONResponse, dumps_quiz, wants_ndjson
+from read_cache import QuizReadCache, cached_response
+from journal import QuizJournal
+from scoring import AnswerKeyIndex, Scoreboard
+from search import SearchIndex
+from metrics import PROMETHEUS_CONTENT_TYPE, configure_json_logging, metrics_middleware, render_metrics, stage
+import settings
+import threading
+import time
 import logging
 from contextlib import asynccontextmanager
+from functools import partial
+from pydantic import BaseModel
 logging.basicConfig(filename="app.log", level=logging.INFO)
+# Per-request stage timings are logged as JSON lines next to the application log
+configure_json_logging(settings.get_str("METRICS_LOG_FILE", "app.log"))
 
 import json
-from bson import ObjectId
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database tables and MongoDB vector store when the FastAPI server starts"""
-    logging.info("Database tables and vector store initialized successfully")
+    """Create the shared MongoDB client and its indexes when the FastAPI server starts"""
+    await run_in_threadpool(init_db)
+    logging.info("MongoDB client and quiz indexes initialized successfully")
+    # Build the duplicate index from the stored questions without delaying startup
+    threading.Thread(target=load_duplicate_index, name="duplicate-index", daemon=True).start()
+    # Loads the search index snapshot (or rebuilds it) in the background, then snapshots it periodically
+    search_index.start()
+    job_manager.start()
+    offloader.start()
+    # Replays anything left in the write-behind journal, then keeps flushing new uploads
+    quiz_journal.start()
+    scoreboard.start()
     yield
-    # Cleanup: Delete the MongoDB collection on shutdown
-    logging.info("Shutting down server, deleting MongoDB vector store collection...")
+    logging.info("Shutting down server, closing MongoDB client...")
+    job_manager.shutdown()
+    offloader.shutdown()
+    # The journal goes first so the final stats flush finds the quizzes it had pending
+    quiz_journal.shutdown()
+    scoreboard.shutdown()
+    search_index.shutdown()
+    close_db()
     # if delete_collection():
     #     logging.info("MongoDB vector store collection deleted successfully during shutdown")
     # else:
@@ -34,6 +68,22 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+# Decoding/parsing executor and admission control for /upload/ and /upload/batch
+offloader = ParseOffloader()
+
+# Limits for POST /upload/batch (number of files, total size after unzipping)
+MAX_BATCH_FILES = settings.get_int("MAX_BATCH_FILES", 500)
+MAX_BATCH_BYTES = settings.get_int("MAX_BATCH_BYTES", 200 * 1024 * 1024)
+
+
+# Uploads take an admission slot (429 when none is free) and are held to their
+# byte limit (413) before their multipart body is received. Added first so it is
+# the innermost middleware: the 413 raised while the route reads the body then
+# reaches FastAPI's exception handler directly.
+app.add_middleware(UploadLimitMiddleware, offloader=offloader,
+                   limits={"/upload/": MAX_UPLOAD_BYTES, "/upload/batch": MAX_BATCH_BYTES})
+
+
 # Configure CORS
 origins = [
     "http://localhost:3000",
@@ -47,79 +97,310 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(metrics_middleware)
+
+# Near-duplicate question index, loaded from MongoDB at startup and updated after every upload.
+# Created on first use: it pulls in scikit-learn, which would dominate the app's import time.
+_duplicate_index = None
+_duplicate_index_lock = threading.Lock()
+
+
+def get_duplicate_index():
+    """Returns the shared DuplicateIndex, creating it on first use."""
+    global _duplicate_index
+    with _duplicate_index_lock:
+        if _duplicate_index is None:
+            from duplicates import DuplicateIndex
+            _duplicate_index = DuplicateIndex()
+        return _duplicate_index
+
+
+def load_duplicate_index():
+    try:
+        duplicate_index = get_duplicate_index()
+        duplicate_index.load_from_collection(get_collection())
+        logging.info(f"Duplicate index loaded with {len(duplicate_index)} questions")
+    except Exception as e:
+        logging.error(f"Failed to load the duplicate index: {e}")
+
+
+# Inverted index for question search, updated after every upload
+search_index = SearchIndex()
+
+
+# Serialized responses of the quiz read API, invalidated by save_quizzes
+quiz_read_cache = QuizReadCache()
+
+
+def invalidate_read_cache(quizzes):
+    quiz_read_cache.invalidate([quiz["heritageId"] for quiz in quizzes])
+
+
+# Answer keys for grading submissions, and the per-quiz stats flushed to MongoDB in batches
+answer_keys = AnswerKeyIndex()
+scoreboard = Scoreboard()
+
 
+def quizzes_flushed(quizzes):
+    invalidate_read_cache(quizzes)
+    # An answer key reloaded while the journal was behind may hold the previous version
+    answer_keys.update(quizzes)
 
-def convert_objectid_to_str(data):
+
+# Uploads are acknowledged once their quizzes are in the journal; it writes them
+# to MongoDB in the background and refreshes the read cache and answer keys when it has
+quiz_journal = QuizJournal(on_flushed=quizzes_flushed)
+
+
+def save_quizzes(quizzes):
     """
-    Recursively traverses a dictionary or list and converts
-    bson.ObjectId objects to their string representation.
+    Durably journals the quizzes for the MongoDB write (giving re-uploaded
+    heritages their stored _id, so responses return it), drops their cached
+    read responses, indexes their answer keys and their questions for
+    duplicate detection and search (blocking).
+
+    Every upload is a write: updatedAt is set to now even when the quizzes came
+    from the parse cache (which keeps the timestamps of their first parse).
     """
-    if isinstance(data, list):
-        return [convert_objectid_to_str(item) for item in data]
-    elif isinstance(data, dict):
-        # Create a new dict to avoid modifying the original during iteration
-        new_dict = {}
-        for key, value in data.items():
-            new_dict[key] = convert_objectid_to_str(value)
-        return new_dict
-    elif isinstance(data, ObjectId):
-        return str(data)
-    else:
-        # Keep other types as they are
-        return data
-    
-@app.post("/upload/") # Renamed endpoint to be more general
-async def upload_quiz_file(file: UploadFile = File(...)):
+    now = int(time.time())
+    for quiz in quizzes:
+        quiz["updatedAt"] = now
+    quiz_journal.append(quizzes)
+    invalidate_read_cache(quizzes)
+    answer_keys.update(quizzes)
+    get_duplicate_index().add_quizzes(quizzes)
+    search_index.add_quizzes(quizzes)
+
+
+async def parse_upload(file_bytes, file_extension):
+    """Runs db.processed_file (hash, parse cache, decode, parse) for an upload off the event loop."""
+    if offloader.kind == "process":
+        # Only the decoding/parsing goes to a worker process: the parse cache lives in this one
+        return await run_in_threadpool(processed_file, file_bytes, file_extension,
+                                       partial(offloader.call, parse_file_bytes))
+    return await offloader.run(processed_file, file_bytes, file_extension)
+
+
+@app.post("/upload/", response_class=QuizJSONResponse) # Renamed endpoint to be more general
+async def upload_quiz_file(request: Request, file: UploadFile = File(...)):
     """
     Receives a .docx, .odt, or .txt file, parses it into quiz data,
-    and returns the data as JSON.
+    and returns every quiz found in the file as a JSON list.
+    With `Accept: application/x-ndjson` the quizzes are streamed one per line instead.
     """
     file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in FILE_READERS:
+        # If extension is not supported, raise an error early
+        raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}. Please upload .docx, .odt, or .txt.")
 
-    # Read the file content as bytes FIRST, as this is needed for all readers
+    # The admission slot and the body size limit were applied by UploadLimitMiddleware;
+    # the part was spooled by the multipart parser, so it is read from there exactly once
     try:
-        file_bytes = await file.read()
+        with stage("upload_read", file_extension.lstrip(".")):
+            file_bytes = await file.read()
     except Exception as e:
          raise HTTPException(status_code=500, detail=f"Error reading uploaded file: {e}")
+    if len(file_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit.")
 
+    # Hash, look up the parse cache, decode and parse the file exactly once (with the
+    # reader matching its extension) off the event loop, which only awaits the result
+    try:
+        my_dicts = await parse_upload(file_bytes, file_extension)
+    except ValueError as ve:
+        # Catch errors from the file readers (decoding) and the parser (format issues)
+        raise HTTPException(status_code=400, detail=f"Parsing error for {file_extension}: {ve}")
+    except Exception as e:
+        # Catch any other unexpected errors during reading/parsing
+        raise HTTPException(status_code=500, detail=f"An internal error occurred during parsing: {e}")
 
-    # Choose the correct reader based on file extension
-    lines_list = []
     try:
-        if file_extension == '.docx':
-            lines_list = read_docx_file(file_bytes)
-        elif file_extension == '.odt':
-            lines_list = read_odt_file(file_bytes)
-            print("Read successfully!")
-        elif file_extension == '.txt':
-            lines_list = read_txt_file(file_bytes)
+        # pymongo is blocking, so the write runs in the threadpool instead of on the event loop
+        await run_in_threadpool(save_quizzes, my_dicts)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An internal error occurred while saving quizzes: {e}")
+
+    # Serialize the quizzes directly (ObjectIds become strings while encoding)
+    if wants_ndjson(request):
+        return QuizNDJSONResponse(my_dicts)
+    with stage("serialize"):
+        return QuizJSONResponse(my_dicts)
+
+
+
+def process_upload(filename, file_bytes):
+    """
+    Parses one uploaded file and persists its quizzes. Blocking: used by the
+    batch job workers, which hand the decoding/parsing to the shared parse
+    executor and wait for it, so batches and /upload/ share its workers.
+    """
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in FILE_READERS:
+        raise ValueError(f"Unsupported file format: {file_extension}. Please upload .docx, .odt, or .txt.")
+    quizzes = processed_file(file_bytes, file_extension, parse=partial(offloader.call, parse_file_bytes))
+    save_quizzes(quizzes)
+    return quizzes
+
+
+job_manager = JobManager(process_upload)
+
+
+def expand_zip(zip_bytes):
+    """Returns the (filename, bytes) of every supported quiz file inside a zip archive."""
+    files = []
+    total_bytes = 0
+    try:
+        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                if os.path.splitext(name)[1].lower() not in FILE_READERS:
+                    continue
+                total_bytes += info.file_size
+                if len(files) >= MAX_BATCH_FILES or total_bytes > MAX_BATCH_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Zip archive exceeds the batch limits ({MAX_BATCH_FILES} files, {MAX_BATCH_BYTES} bytes).")
+                files.append((name, archive.read(info)))
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    return files
+
+
+@app.post("/upload/batch", status_code=202)
+async def upload_quiz_batch(files: list[UploadFile] = File(...)):
+    """
+    Receives many .docx/.odt/.txt files (or a single .zip of them), queues
+    them as a background job and immediately returns the job id.
+    Progress and per-file results are available at GET /jobs/{job_id}.
+    Admission and the MAX_BATCH_BYTES body limit are applied by UploadLimitMiddleware.
+    """
+    batch = []
+    total_bytes = 0
+    for file in files:
+        try:
+            file_bytes = await file.read()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error reading uploaded file {file.filename}: {e}")
+        if os.path.splitext(file.filename)[1].lower() == ".zip":
+            batch.extend(await run_in_threadpool(expand_zip, file_bytes))
         else:
-            # If extension is not supported, raise an error early
-            raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}. Please upload .docx, .odt, or .txt.")
+            batch.append((file.filename, file_bytes))
+        total_bytes += len(file_bytes)
+        if len(batch) > MAX_BATCH_FILES or total_bytes > MAX_BATCH_BYTES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the limits ({MAX_BATCH_FILES} files, {MAX_BATCH_BYTES} bytes).")
+
+    if not batch:
+        raise HTTPException(status_code=400, detail="No .docx, .odt, or .txt files found in the upload.")
+
+    job = job_manager.submit(batch)
+    return {"jobId": job["jobId"], "status": job["status"], "total": job["total"], "statusUrl": f"/jobs/{job['jobId']}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the status of a batch upload job with per-file progress and results."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+# Page size limits for GET /quizzes
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+@app.get("/quizzes")
+async def get_quizzes(request: Request, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE):
+    """
+    Lists quiz summaries (heritageId, title, status, updatedAt) ordered by
+    heritageId, `page_size` per page. Cached, with ETag revalidation.
+    """
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page must be >= 1 and page_size between 1 and {MAX_PAGE_SIZE}")
+    skip = (page - 1) * page_size
+    entry = quiz_read_cache.get_page(skip, page_size)
+    if entry is None:
+        generation = quiz_read_cache.generation
+        total, quizzes = await run_in_threadpool(list_quizzes, skip, page_size)
+        body = dumps_quiz({"page": page, "pageSize": page_size, "total": total, "items": quizzes})
+        entry = quiz_read_cache.put_page(skip, page_size, body, generation)
+    return cached_response(request, entry)
 
-    except ValueError as ve:
-        # Catch errors specifically from the file reading functions
-         raise HTTPException(status_code=400, detail=f"File reading/decoding error for {file_extension}: {ve}")
-    except Exception as e:
-        # Catch any unexpected errors during reading
-        raise HTTPException(status_code=500, detail=f"An internal error occurred during file reading: {e}")
 
+@app.get("/quizzes/{heritage_id}")
+async def get_quiz(request: Request, heritage_id: str):
+    """Returns the quiz of one heritage. Cached, with ETag revalidation (304 Not Modified)."""
+    entry = quiz_read_cache.get_quiz(heritage_id)
+    if entry is None:
+        generation = quiz_read_cache.generation
+        quiz = await run_in_threadpool(find_quiz, heritage_id)
+        if quiz is None:
+            raise HTTPException(status_code=404, detail=f"No quiz found for heritageId {heritage_id}")
+        entry = quiz_read_cache.put_quiz(heritage_id, dumps_quiz(quiz), generation)
+    return cached_response(request, entry)
 
-    # Pass the list of lines to the generic parser
+
+class Submission(BaseModel):
+    userId: str
+    userName: str = ""
+    answers: dict[str, str]  # questionId -> chosen optionId
+    durationSeconds: float | None = None
+
+
+@app.post("/quizzes/{heritage_id}/submit")
+async def submit_quiz(heritage_id: str, submission: Submission):
+    """
+    Grades a submission against the quiz's answer key and records it in the
+    quiz stats and top performers (written to MongoDB by the next stats flush).
+    """
+    key = answer_keys.get(heritage_id, submission.answers)
+    if key is None:
+        key = await run_in_threadpool(answer_keys.load, heritage_id)
+        if key is None:
+            raise HTTPException(status_code=404, detail=f"No quiz found for heritageId {heritage_id}")
+    return scoreboard.record(key, submission.userId, submission.answers,
+                             user_name=submission.userName, duration_seconds=submission.durationSeconds)
+
+
+@app.get("/questions/search")
+async def search_questions(q: str, limit: int = 20, heritage_id: str | None = None):
+    """
+    Searches question content, options and explanations across heritages (or
+    within one). Accent-insensitive: "Ho Chi Minh" also finds "Hồ Chí Minh".
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    results = await run_in_threadpool(search_index.search, q, limit=limit, heritage_id=heritage_id)
+    return {"query": q, "ready": search_index.ready, "count": len(results), "results": results}
+
+
+@app.get("/questions/similar")
+async def get_similar_questions(text: str, limit: int = 10, min_score: float = 0.3):
+    """Returns the stored questions most similar to `text`."""
+    return await run_in_threadpool(get_duplicate_index().similar, text=text, limit=limit, min_score=min_score)
+
+
+@app.get("/questions/duplicates")
+async def get_duplicate_questions(threshold: float = 0.8, limit: int = 1000):
+    """Reports pairs of stored questions that are near-duplicates of each other, most similar first."""
+    pairs = await run_in_threadpool(get_duplicate_index().duplicates, threshold=threshold, limit=limit)
+    return {"threshold": threshold, "count": len(pairs), "pairs": pairs}
+
+
+@app.get("/questions/{question_id}/similar")
+async def get_questions_similar_to(question_id: str, limit: int = 10, min_score: float = 0.3):
+    """Returns the stored questions most similar to the question `question_id`."""
     try:
-        # print("Line list\n", lines_list)
-        # parsed_data = parse_quiz_lines(lines_list)
-        my_dicts = processed_odt_file(file_bytes)
-        insert_to_db(my_dicts)
-        result_dict = my_dicts[0]
-        serializable_result = convert_objectid_to_str(result_dict) # Convert ObjectId to str
-        return serializable_result # Return the fully serializable dictionary
-    except ValueError as ve:
-        # Catch specific errors from the parser (e.g., format issues)
-        raise HTTPException(status_code=400, detail=f"Parsing error: {ve}")
-    except Exception as e:
-        # Catch any other unexpected errors during parsing
-        raise HTTPException(status_code=500, detail=f"An internal error occurred during parsing: {e}")
+        return await run_in_threadpool(get_duplicate_index().similar, question_id=question_id, limit=limit, min_score=min_score)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Question {question_id} not found")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Exposes request and pipeline metrics in the Prometheus text format."""
+    return Response(content=render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 
 @app.get("/")
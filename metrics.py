@@ -0,0 +1,245 @@
+"""
+In-process metrics: counters and latency histograms rendered in the
+Prometheus text exposition format, plus per-request stage timings written
+as structured JSON logs.
+
+Usage:
+    with stage("parse"):
+        quizzes = parse_quiz_lines(lines)
+    QUIZZES.inc(len(quizzes))
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the request being handled ({stage: seconds}), or None outside a request
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Computes the (unlabelled) value when the metrics are rendered, e.g. a current lag."""
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        for bound, count in zip(self.buckets, state["counts"]):
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {count}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_metrics():
+    """Returns every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics of the quiz service ---
+
+REQUEST_LATENCY = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ("method", "path", "status")))
+STAGE_LATENCY = register(Histogram(
+    "quiz_stage_duration_seconds", "Latency of the upload pipeline stages.", ("stage", "format")))
+FILES = register(Counter("quiz_files_total", "Uploaded files processed.", ("format", "status")))
+QUIZZES = register(Counter("quiz_quizzes_total", "Quizzes parsed from uploaded files."))
+QUESTIONS = register(Counter("quiz_questions_total", "Questions parsed from uploaded files."))
+PARSE_WARNINGS = register(Counter("quiz_parse_warnings_total", "Warnings emitted by the quiz parser."))
+PARSE_CACHE_HITS = register(Counter("quiz_parse_cache_hits_total", "Uploads served from the parse cache."))
+JOURNAL_PENDING = register(Gauge(
+    "quiz_journal_pending_uploads", "Uploads written to the journal but not yet to MongoDB."))
+JOURNAL_LAG = register(Gauge(
+    "quiz_journal_lag_seconds", "Age of the oldest journal entry not yet written to MongoDB."))
+JOURNAL_FLUSHES = register(Counter(
+    "quiz_journal_flushes_total", "Journal flush attempts to MongoDB.", ("status",)))
+QUIZ_READ_CACHE = register(Counter("quiz_read_cache_requests_total", "Quiz read API cache lookups.", ("result",)))
+SUBMISSIONS = register(Counter("quiz_submissions_total", "Quiz submissions graded."))
+
+
+def observe_stage(name, seconds, file_format=""):
+    """Records a pipeline stage duration measured elsewhere (e.g. in a worker process)."""
+    STAGE_LATENCY.observe(seconds, stage=name, format=file_format)
+    stages = _request_stages.get()
+    if stages is not None:
+        key = f"{name}[{file_format}]" if file_format else name
+        stages[key] = round(stages.get(key, 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def stage(name, file_format=""):
+    """Times a pipeline stage into STAGE_LATENCY and the current request's structured log."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started, file_format)
+
+
+def record_quizzes(quizzes):
+    QUIZZES.inc(len(quizzes))
+    QUESTIONS.inc(sum(len(quiz["questions"]) for quiz in quizzes))
+
+
+# --- Structured logging ---
+
+logger = logging.getLogger("metrics")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records whose message is a dict as one JSON object per line."""
+
+    def format(self, record):
+        payload = {"time": round(record.created, 3), "level": record.levelname, "logger": record.name}
+        if isinstance(record.msg, dict):
+            payload.update(record.msg)
+        else:
+            payload["message"] = record.getMessage()
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_json_logging(filename):
+    """Sends the metrics logger's records to `filename` as JSON lines."""
+    if any(getattr(handler, "_metrics_json", False) for handler in logger.handlers):
+        return
+    handler = logging.FileHandler(filename, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    handler._metrics_json = True
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class _ParseWarningCounter(logging.Handler):
+    def emit(self, record):
+        PARSE_WARNINGS.inc()
+
+
+logging.getLogger("parser").addHandler(_ParseWarningCounter(level=logging.WARNING))
+
+
+async def metrics_middleware(request, call_next):
+    """Records request latency and logs the request with its stage timings as JSON."""
+    stages = {}
+    token = _request_stages.set(stages)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _request_stages.reset(token)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_LATENCY.observe(elapsed, method=request.method, path=path, status=status)
+        if path != "/metrics":
+            logger.info({
+                "event": "request",
+                "method": request.method,
+                "path": path,
+                "status": status,
+                "durationMs": round(elapsed * 1000, 3),
+                "stages": stages,
+            })
@@ -0,0 +1,108 @@
+"""
+Compact in-memory representation of parsed quizzes.
+
+The parser builds Quiz, Question and Option objects with __slots__ (no
+per-instance __dict__), keeps option texts in a fixed A-D list instead of an
+intermediate dict, and only creates ObjectIds when they are first needed
+(bson itself is imported with the first one). Everything is converted once,
+at the output boundary, by Quiz.to_dict(), which produces exactly the
+document structure written to MongoDB and returned as JSON.
+"""
+OPTION_LETTERS = ('A', 'B', 'C', 'D')
+
+_ObjectId = None
+
+
+def new_object_id():
+    """Returns a new bson.ObjectId, importing bson on first use."""
+    global _ObjectId
+    if _ObjectId is None:
+        from bson import ObjectId
+        _ObjectId = ObjectId
+    return _ObjectId()
+
+
+class Option:
+    __slots__ = ('text', 'is_correct', '_option_id')
+
+    def __init__(self, text, is_correct=False):
+        self.text = text
+        self.is_correct = is_correct
+        self._option_id = None
+
+    @property
+    def option_id(self):
+        """The option's id as a string, generated on first access."""
+        if self._option_id is None:
+            self._option_id = str(new_object_id())
+        return self._option_id
+
+    def to_dict(self):
+        return {"optionText": self.text, "isCorrect": self.is_correct, "optionId": self.option_id}
+
+
+class Question:
+    __slots__ = ('content', 'explanation', 'image', 'options', '_question_id')
+
+    def __init__(self, content, explanation="", image=""):
+        self.content = content
+        self.explanation = explanation
+        self.image = image
+        self.options = []
+        self._question_id = None
+
+    @property
+    def question_id(self):
+        """The question's ObjectId, generated on first access."""
+        if self._question_id is None:
+            self._question_id = new_object_id()
+        return self._question_id
+
+    def to_dict(self):
+        return {
+            "explanation": self.explanation,
+            "image": self.image,
+            "content": self.content,
+            "questionId": self.question_id,
+            "options": [option.to_dict() for option in self.options],
+        }
+
+
+class Quiz:
+    __slots__ = ('heritage_id', 'title', 'content', 'questions', 'top_performers_limit',
+                 'status', 'created_at', 'updated_at', '_id')
+
+    def __init__(self, heritage_id, title, content, created_at, updated_at,
+                 top_performers_limit=10, status="INACTIVE"):
+        self.heritage_id = heritage_id
+        self.title = title
+        self.content = content
+        self.questions = []
+        self.top_performers_limit = top_performers_limit
+        self.status = status
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self._id = None
+
+    @property
+    def id(self):
+        """The quiz document's ObjectId, generated on first access."""
+        if self._id is None:
+            self._id = new_object_id()
+        return self._id
+
+    def to_dict(self):
+        """Converts the quiz to the dictionary stored in MongoDB and returned by the API."""
+        return {
+            "_id": self.id,
+            "heritageId": self.heritage_id,
+            "title": self.title,
+            "content": self.content,
+            "questions": [question.to_dict() for question in self.questions],
+            "topPerformersLimit": self.top_performers_limit,
+            "stats": {},
+            "topPerformers": [],
+            "status": self.status,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+        }
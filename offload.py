@@ -0,0 +1,137 @@
+"""
+Keeps CPU-bound upload work off the event loop.
+
+* UploadLimitMiddleware admits or rejects upload requests before their body
+  is read: an admission semaphore bounds the uploads processed at once (extra
+  requests get an immediate 429 instead of queueing behind a busy worker),
+  and bodies past the route's byte limit get a 413, from the Content-Length
+  header when there is one and otherwise as soon as the received bytes go
+  over the limit (chunked uploads).
+* Decoding/parsing runs on a thread or process pool (PARSE_EXECUTOR).
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+import settings
+
+MAX_UPLOAD_BYTES = settings.get_int("MAX_UPLOAD_BYTES", 20 * 1024 * 1024)
+MAX_CONCURRENT_UPLOADS = settings.get_int("MAX_CONCURRENT_UPLOADS", (os.cpu_count() or 1) * 2)
+PARSE_EXECUTOR = settings.get_str("PARSE_EXECUTOR", "thread")  # "thread" or "process"
+PARSE_WORKERS = settings.get_int("PARSE_WORKERS", os.cpu_count() or 1)
+# Room allowed for the multipart envelope around the files themselves
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class ParseOffloader:
+    """Runs blocking parse work on an executor behind an admission semaphore."""
+
+    def __init__(self, kind=PARSE_EXECUTOR, workers=PARSE_WORKERS, max_concurrent=MAX_CONCURRENT_UPLOADS):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"PARSE_EXECUTOR must be 'thread' or 'process', got {kind!r}")
+        self.kind = kind
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self._executor = None
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def start(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @asynccontextmanager
+    async def admit(self):
+        """Holds one admission slot for the duration of the block, or fails fast with 429."""
+        if self._semaphore.locked():
+            raise HTTPException(status_code=429, detail="Too many uploads in progress, please retry shortly.",
+                                headers={"Retry-After": "1"})
+        async with self._semaphore:
+            yield
+
+    async def run(self, func, *args):
+        """
+        Runs func(*args) on the executor and awaits its result. On the thread
+        executor it runs in a copy of the caller's context, so the stage
+        timings it records land in the current request's log.
+        """
+        self.start()
+        if self.kind == "thread":
+            func, args = contextvars.copy_context().run, (func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def call(self, func, *args):
+        """Runs func(*args) on the executor and waits for its result (for worker threads, not the event loop)."""
+        self.start()
+        return self._executor.submit(func, *args).result()
+
+
+def check_content_length(headers, max_bytes=MAX_UPLOAD_BYTES):
+    """Rejects obviously oversized requests with 413 from their Content-Length header."""
+    content_length = headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes} byte limit.")
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware applying admission control and body size limits to the
+    upload routes, before any of the request body is received. Add it as the
+    innermost middleware, so the 413 raised while the route reads an
+    oversized body reaches FastAPI's exception handler unwrapped.
+
+    Args:
+        app: The wrapped ASGI application.
+        offloader: The ParseOffloader whose admission slots the uploads take.
+        limits: {path: maximum file bytes} of the routes to guard.
+    """
+
+    def __init__(self, app, offloader, limits):
+        self.app = app
+        self.offloader = offloader
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        try:
+            check_content_length(headers, max_bytes)
+            async with self.offloader.admit():
+                await self.app(scope, self._limited_receive(receive, max_bytes), send)
+        except HTTPException as e:
+            # Only raised before the application started answering: the body limit is
+            # enforced inside the route, whose HTTPException handler turns it into a 413
+            response = JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+            await response(scope, receive, send)
+
+    @staticmethod
+    def _limited_receive(receive, max_bytes):
+        limit = max_bytes + MULTIPART_OVERHEAD_BYTES
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes} byte limit.")
+            return message
+
+        return limited_receive
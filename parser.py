@@ -1,30 +1,26 @@
-import docx
-import uuid
 import time
 import io
+import logging
+import zipfile
 import re
+import threading
 import unicodedata
 
-from bson import ObjectId
-# from odfpy import opendocument, text as odf_text # Import odfpy components
-# from odf import opendocument, text as odf_text
-from odf import opendocument
-from odf.text import P, H
-
-# Helper function to map option letters (A, B, C, D) to JSON keys (1, 2, 3, 4)
-OPTION_KEY_MAP = {
-    'A': '0',
-    'B': '1',
-    'C': '2',
-    'D': '3'
-}
+from models import OPTION_LETTERS, Option, Question, Quiz
+
+logger = logging.getLogger(__name__)
 
-def finalize_and_add_question(quiz_obj, question_obj, options_text_map, correct_letter):
+def finalize_and_add_question(quiz_obj, question_obj, option_texts, correct_letter):
     """
-    Helper function to process the collected question data, format options,
-    and add the complete question object to the quiz's questions list.
+    Helper function to attach the collected options to the question and add
+    the question to the quiz's questions list.
     Called when a question block is finished.
-    Uses bson.ObjectId for option IDs.
+
+    Args:
+        quiz_obj: The models.Quiz being built.
+        question_obj: The models.Question being built.
+        option_texts: Full option lines indexed like OPTION_LETTERS ("" when missing).
+        correct_letter: The correct option letter (A-D), or None.
     """
     if not quiz_obj or not question_obj:
         # Nothing to finalize if we don't have a quiz or question object
@@ -32,299 +28,378 @@ def finalize_and_add_question(quiz_obj, question_obj, options_text_map, correct_
 
     # Check if we actually collected meaningful data for this question
     # (e.g., content or options)
-    if not question_obj.get('content') and not options_text_map:
-        # print("end")
+    if not question_obj.content and not any(option_texts):
         return # Don't add empty question blocks
 
-    question_obj['questionId'] = ObjectId() # Generate ID for the question
-    options_list = {}
+    # All expected options A, B, C, D are always present, even if text
+    # wasn't found for them in the input. Their ids are generated lazily.
+    question_obj.options = [
+        Option(text.strip(), letter == correct_letter)
+        for letter, text in zip(OPTION_LETTERS, option_texts)
+    ]
+
+    # Add the complete question object to the quiz's questions list
+    quiz_obj.questions.append(question_obj)
+
 
-    # Ensure all expected options A, B, C, D are present based on map,
-    # even if text wasn't found for them in the input.
-    expected_letters = ['A', 'B', 'C', 'D']
+def simple_normalize(text):
+    # NFC-normalize, then collapse every run of whitespace to a single space.
+    # str.split() uses the same notion of whitespace as the regex \s, but avoids the regex engine.
+    text = unicodedata.normalize('NFC', text)
+    return ' '.join(text.split())
 
-    for letter in expected_letters:
-        # Get the full line text stored during parsing
-        full_option_text = options_text_map.get(letter, "").strip()
 
-        # Determine if this option is correct based on the extracted correct_letter
-        is_correct = (letter == correct_letter)
+# Vietnamese "đ" is a separate letter, not "d" with a combining mark, so NFD leaves it alone
+ACCENT_FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
 
-        option_key = OPTION_KEY_MAP.get(letter) # Get the corresponding JSON key (1, 2, 3, 4)
 
-        if option_key: # Make sure mapping exists
-            options_list[option_key] = {
-                "optionText": full_option_text,
-                "isCorrect": is_correct,
-                "optionId": str(ObjectId()) # Generate ObjectId for the option
-            }
-        else:
-             print(f"Warning: No mapping found for option letter '{letter}'")
+def fold_accents(text):
+    # Strips Vietnamese diacritics ("Hồ Chí Minh" -> "Ho Chi Minh") for accent-insensitive matching.
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return unicodedata.normalize('NFC', stripped).translate(ACCENT_FOLD_TABLE)
 
-    
-    options_arr = []
-    for item in options_list.items():
-        options_arr.append(item[1]) # tuple of (key, value)
-    question_obj['options'] = options_arr
 
-    # print(f"Adding question obj: {question_obj}")
-    # Add the complete question object to the quiz's questions list
-    quiz_obj['questions'].append(question_obj)
+# Options are stored as full lines ("A. Đông"); the letter prefix is not content
+OPTION_PREFIX = re.compile(r'^\s*[A-D]\.\s*')
 
+# Punctuation-only tokens are dropped by tokenize_text
+PUNCTUATION_TOKEN = re.compile(r'^\W+$')
 
-def simple_normalize(text):
-    text = unicodedata.normalize('NFC', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
 
+_word_tokenize = None
+_word_tokenize_lock = threading.Lock()
 
 
-def parse_quiz_lines(lines_list):
+def load_word_tokenize():
     """
-    Parses a list of text lines/paragraphs containing quiz data and converts
-    it into a structured format, matching the ODT example structure where
-    question content is on the same line as 'Câu hỏi N:'.
+    Returns underthesea's word_tokenize, or None if underthesea is not installed.
+    The first call loads its segmentation model under a lock: underthesea
+    publishes the model before it is loaded, so concurrent first calls from
+    several threads would otherwise fail.
+    """
+    global _word_tokenize
+    if _word_tokenize is None:
+        with _word_tokenize_lock:
+            if _word_tokenize is None:
+                try:
+                    from underthesea import word_tokenize
+                except ImportError:
+                    word_tokenize = False
+                else:
+                    word_tokenize("khởi động")
+                _word_tokenize = word_tokenize
+    return _word_tokenize or None
+
+
+def tokenize_text(text):
+    """
+    Splits Vietnamese text into lower-cased words after simple_normalize.
+    Uses underthesea's word segmentation, so compound words such as
+    'Hồ Chí Minh' stay one token; falls back to whitespace splitting if
+    underthesea is not installed.
+    """
+    text = simple_normalize(text).lower()
+    if not text:
+        return []
+    word_tokenize = load_word_tokenize()
+    tokens = word_tokenize(text) if word_tokenize else text.split()
+    return [token for token in tokens if not PUNCTUATION_TOKEN.match(token)]
+
+
+# Single dispatch regex used to classify every (normalized) line with one match call.
+# The name of the alternative that matched (match.lastgroup) is the line kind.
+LINE_PATTERN = re.compile(
+    r'(?P<heritage>Heritage:)'
+    r'|(?P<link>Link tham kh(?:ao|ảo):)'
+    # "Câu <number>:" or "Câu hỏi <number>:" ('hỏi' is optional)
+    r'|(?P<question>Câu\s*(?:hỏi)?\s*\d+\s*:)'
+    r'|(?P<option>(?P<option_letter>[A-D])\.)'
+    # The correct letter must directly follow the label, e.g. "Đáp án đúng: B. Năm 1397" or "Đáp án đúng: B"
+    r'|(?P<answer>(?:Dap an dung|Đáp án đúng):\s*(?P<answer_letter>[A-D])?)'
+    r'|(?P<explanation>(?:Giai thich|Giải thích):)'
+)
+
+# Some documents lose the paragraph break between the question and its first
+# option, e.g. "Câu 2: ... quay về hướng nào?A. Đông" (see output.txt).
+INLINE_OPTION_PATTERN = re.compile(r'\?\s*(A\..*)$')
+
+
+def parse_heritage_line(text):
+    """
+    Builds a new models.Quiz from a 'Heritage:' line.
+    Example: Heritage: Thành nhà Hồ: heritageId: 67f3edb13834bd66e6e1c678
+    """
+    parts = text.split(':', 2) # Split into max 3 parts: "Heritage", " Name ", " heritageId: ID"
+    heritage_name = parts[1].strip() if len(parts) > 1 else "Unknown Heritage"
+
+    # Find heritageId part more reliably, splitting by 'heritageId:'
+    # Handle potential leading/trailing spaces around the id part after splitting by ':'
+    heritage_id_part = ""
+    if len(parts) > 2:
+        id_segment = parts[2].strip()
+        id_parts = id_segment.split('heritageId:')
+        if len(id_parts) > 1:
+            heritage_id_part = id_parts[1].strip() # Get the part after 'heritageId:'
+
+    heritage_id = heritage_id_part if heritage_id_part else "unknown_id"
+
+    now = int(time.time()) # Unix timestamp
+    return Quiz(
+        heritage_id=heritage_id, # Store heritageId as string
+        title=f"Kiểm tra di tích lịch sử {heritage_name}",
+        content=f"Bài kiểm tra này sẽ giúp bạn hiểu rõ hơn về {heritage_name}",
+        created_at=now,
+        updated_at=now,
+    )
+
+
+# Position of each option letter in a question's option list
+OPTION_INDEX = {letter: index for index, letter in enumerate(OPTION_LETTERS)}
+
+
+def parse_quiz_models(lines_iter):
+    """
+    Parses quiz text lines/paragraphs one at a time and yields each quiz
+    as soon as it is complete, i.e. when the next 'Heritage:' line or the
+    end of the input closes it. Question content is expected on the same
+    line as 'Câu hỏi N:'.
+
+    Only the quiz being built is kept in memory, so arbitrarily large
+    combined question banks can be parsed with constant memory.
 
     Args:
-        lines_list: A list of strings, where each string is a line or paragraph
-                    from the document.
+        lines_iter: Any iterable of strings (a list, a generator over a file,
+                    a streaming document reader...).
 
-    Returns:
-        A list of dictionaries, each representing a complete quiz object
-        in the target JSON structure.
+    Yields:
+        models.Quiz objects; call to_dict() to get the target JSON structure.
     """
-    quizzes = []
     current_quiz = None
     current_question = None
-    current_options_text = {} # To store A, B, C, D full line text temporarily
+    current_options_text = [""] * len(OPTION_LETTERS) # To store A, B, C, D full line text temporarily
     correct_answer_letter = None # To store the correct letter (A, B, C, D)
     reference_link = "" # Variable to store the reference link for the current heritage
 
-    # Regex to find "Câu <number>:" or "Câu hỏi <number>:" at the start of the line
-    # Added \s* after ^ to handle potential leading whitespace in the line itself
-    # Made 'hỏi' optional `(hỏi)?`
-    cau_pattern = re.compile(r'^\s*Câu\s*(hỏi)?\s*\d+\s*:')
-
-    # No need for awaiting_question_content_line flag with this format
-
-    for line in lines_list:
+    for line in lines_iter:
         # Apply normalization and strip whitespace from the line
-        text = simple_normalize(line) # Use the simple_normalize function
-        text = text.strip()
+        text = simple_normalize(line)
 
         if not text:
             # Skip empty lines
             continue
 
-        # --- State Machine Logic based on line patterns ---
+        match = LINE_PATTERN.match(text)
+        if match is None:
+            # Stray text (outside or inside a question block) is ignored
+            continue
+        kind = match.lastgroup
+
+        # --- State Machine Logic based on the line kind ---
 
         # 1. Heritage Section
-        # Must NOT be inside a question block (current_question is None) to avoid misinterpretation
-        if text.startswith('Heritage:') and current_question is None:
-            # Finalize the previous quiz if exists
+        # A new 'Heritage:' line always closes the previous quiz (including its
+        # last question), so files with several heritages yield several quizzes.
+        if kind == 'heritage':
             if current_quiz:
-                 # Ensure the last question of the previous quiz is added
-                 if current_question: # Check again inside the if
+                # Ensure the last question of the previous quiz is added
+                if current_question:
                     finalize_and_add_question(
                         current_quiz,
                         current_question,
                         current_options_text,
                         correct_answer_letter
                     )
-                 # Reset question state for the next section
-                 current_question = None
-                 current_options_text = {}
-                 correct_answer_letter = None
-                 reference_link = "" # Reset reference link for the new heritage
-
-
-            # Start a new quiz
-            # Example: Heritage: Thành nhà Hồ: heritageId: 67f3edb13834bd66e6e1c678
-            parts = text.split(':', 2) # Split into max 3 parts: "Heritage", " Name ", " heritageId: ID"
-            heritage_name = parts[1].strip() if len(parts) > 1 else "Unknown Heritage"
-
-            # Find heritageId part more reliably, splitting by 'heritageId:'
-            # Handle potential leading/trailing spaces around the id part after splitting by ':'
-            heritage_id_part = ""
-            if len(parts) > 2:
-                id_segment = parts[2].strip()
-                id_parts = id_segment.split('heritageId:')
-                if len(id_parts) > 1:
-                    heritage_id_part = id_parts[1].strip() # Get the part after 'heritageId:'
-
-            heritage_id = heritage_id_part if heritage_id_part else "unknown_id"
-
-
-            current_quiz = {
-                "_id": ObjectId(), # Generate a unique ObjectId for the quiz
-                "heritageId": heritage_id, # Store heritageId as string
-                "title": f"Kiểm tra di tích lịch sử {heritage_name}",
-                "content": f"Bài kiểm tra này sẽ giúp bạn hiểu rõ hơn về {heritage_name}",
-                "questions": [],
-                "topPerformersLimit": 10,
-                "stats": {},
-                "topPerformers": [],
-                "status": "INACTIVE",
-                "createdAt": int(time.time()), # Unix timestamp
-                "updatedAt": int(time.time())  # Unix timestamp
-            }
-            quizzes.append(current_quiz)
-            # print(f"Debug: Started new quiz: {heritage_name} ({heritage_id})") # Optional debug
-            continue # Move to the next paragraph/line
+                yield current_quiz
+                # Reset question state for the next section
+                current_question = None
+                current_options_text = [""] * len(OPTION_LETTERS)
+                correct_answer_letter = None
+                reference_link = "" # Reset reference link for the new heritage
+
+            current_quiz = parse_heritage_line(text)
+            continue
 
         # 2. Link (Capture the reference link)
-        # Handle both spellings and store the text after the colon
-        # Must also NOT be inside a question block
-        if text.startswith(('Link tham khao:', 'Link tham khảo:')) and current_question is None:
-             # Extract the URL part after the prefix
-             link_part = text.split(':', 1)[1].strip() if ':' in text else ""
-             reference_link = text # Store the extracted link text
-             # print(f"Debug: Captured link: {reference_link}") # Optional debug
-             continue
-
-        # 3. Separator (Handle if present, although not in your latest sample)
-        # This signals the end of a question block, potentially starting a new one soon.
-        # if text.startswith('-----'):
-        #      # Finalize and add the current question if one is being processed
-        #      if current_quiz and current_question:
-        #          finalize_and_add_question(
-        #              current_quiz,
-        #              current_question,
-        #              current_options_text,
-        #              correct_answer_letter
-        #          )
-        #          # Reset question state for the next potential question
-        #          current_question = None
-        #          current_options_text = {}
-        #          correct_answer_letter = None
-
-        #      # print("Debug: Hit separator") # Optional debug
-        #      continue # Move to the next paragraph/line
-
-        # 4. Start of a new Question Block ("Câu N:" or "Câu hỏi N:")
-        # This line now CONTAINS the question content.
-        if cau_pattern.match(text):
-            # print(f"Debug: Starting new question block: {text}") # Optional debug
+        # Handle both spellings and store the whole line; must NOT be inside a question block
+        if kind == 'link':
+            if current_question is None:
+                reference_link = text
+            continue
 
+        # 3. Start of a new Question Block ("Câu N:" or "Câu hỏi N:")
+        # This line CONTAINS the question content.
+        if kind == 'question':
             # Finalize and add the previous question if one was being processed
-            # This handles cases where the file doesn't end with a separator
-            # and a new question block starts right after the previous one ends.
             if current_quiz and current_question:
-                 finalize_and_add_question(
-                     current_quiz,
-                     current_question,
-                     current_options_text,
-                     correct_answer_letter
-                 )
-                 # Reset question state for the new question
-                 current_question = None # This will be created below
-                 current_options_text = {}
-                 correct_answer_letter = None
-
-
-            # Start a new question object dictionary
-            if current_quiz is None:
-                 # We found a question before a Heritage block. This is an error
-                 # based on the expected structure.
-                 raise ValueError("File format error: Question found before a 'Heritage:' block.")
+                finalize_and_add_question(
+                    current_quiz,
+                    current_question,
+                    current_options_text,
+                    correct_answer_letter
+                )
+                # Reset question state for the new question
+                current_options_text = [""] * len(OPTION_LETTERS)
+                correct_answer_letter = None
 
-            # Create the dictionary for the new question
-            current_question = {
-                "explanation": "", # Initialize explanation
-                "image": "" # Always empty as per the target structure
-            }
+            if current_quiz is None:
+                # We found a question before a Heritage block. This is an error
+                # based on the expected structure.
+                raise ValueError("File format error: Question found before a 'Heritage:' block.")
 
             # Extract the question content from *this* line (after the colon)
-            content_part = text.split(':', 1)[1].strip() if ':' in text else ""
-            current_question['content'] = content_part
-            # print(f"Debug: Captured question content from same line: '{current_question['content']}'") # Optional debug
+            content_part = text[match.end():].strip()
+            inline_option = INLINE_OPTION_PATTERN.search(content_part)
+            if inline_option:
+                # "...hướng nào?A. Đông": split off option A that was glued to the question
+                current_options_text[OPTION_INDEX['A']] = inline_option.group(1).strip()
+                content_part = content_part[:inline_option.start() + 1]
+
+            current_question = Question(content_part) # Explanation and image start empty
+            continue # Move to the next line, expecting options
 
+        # --- Now, process lines that are part of a question block ---
+        if current_question is None:
+            continue
 
-            # No need to set awaiting_question_content_line as content is on this line
+        # 4. Options Text (A., B., C., D.)
+        # Store the ENTIRE line here, not just the text after the dot
+        if kind == 'option':
+            current_options_text[OPTION_INDEX[match.group('option_letter')]] = text
+
+        # 5. Correct Answer ("Dap an dung:" or "Đáp án đúng:")
+        elif kind == 'answer':
+            correct_answer_letter = match.group('answer_letter')
+            if correct_answer_letter is None:
+                # Handle case where correct answer format is unexpected
+                logger.warning(f"Could not extract correct answer letter from '{text}'. Setting correct_answer_letter to None.")
+
+        # 6. Explanation ("Giai thich:" or "Giải thích:")
+        elif kind == 'explanation':
+            explanation_text = text[match.end():].strip()
+            # Append the reference link if one was captured for this heritage
+            if reference_link:
+                current_question.explanation = explanation_text + " " + reference_link
+            else:
+                current_question.explanation = explanation_text
+
+    # --- After the input ends, finalize the very last question and quiz ---
+    if current_quiz:
+        if current_question:
+            finalize_and_add_question(
+                quiz_obj=current_quiz,
+                question_obj=current_question,
+                option_texts=current_options_text,
+                correct_letter=correct_answer_letter
+            )
+        yield current_quiz
+
+
+def parse_quiz_stream(lines_iter):
+    """
+    Like parse_quiz_models, but yields each quiz as a dictionary in the
+    target JSON structure (the single conversion at the output boundary).
+    """
+    for quiz in parse_quiz_models(lines_iter):
+        yield quiz.to_dict()
 
-            continue # Move to the next line, expecting options
 
+def parse_quiz_lines(lines_list):
+    """
+    Parses a list of text lines/paragraphs containing quiz data and converts
+    it into a structured format. Thin wrapper around parse_quiz_stream.
 
-        # --- Now, process lines that are part of a question block (current_question is not None) ---
-        # These checks should only run IF we have an active current_question
-        if current_question is not None:
-
-            # 5. Options Text (A., B., C., D.)
-            # Must start with A., B., C., or D.
-            # Store the ENTIRE line here, not just the text after the dot
-            if text.startswith(('A.', 'B.', 'C.', 'D.')):
-                parts = text.split('.', 1) # Split only on the first dot to get the letter
-                if len(parts) >= 1: # Should always be at least 1 part if it starts with Letter.
-                    option_letter = parts[0].strip() # Get the letter (e.g., "A")
-                    if option_letter in ['A', 'B', 'C', 'D']:
-                       # Store the full stripped line text
-                       current_options_text[option_letter] = text.strip()
-                       # print(f"Debug: Captured option {option_letter}: '{text}'") # Optional debug
-                    else:
-                       print(f"Warning: Found line starting with '{option_letter}.' not A, B, C, or D within question block: '{text}'")
-                continue # Move to the next line
-
-            # 6. Correct Answer
-            # Must start with "Dap an dung:" or "Đáp án đúng:"
-            elif text.startswith(('Dap an dung:', 'Đáp án đúng:')):
-                # Example: "Đáp án đúng: B. Năm 1397"
-                # Extract the part after the label
-                answer_part = text.split(':', 1)[1].strip() if ':' in text else text.strip()
-
-                # Find the first letter (A, B, C, or D) in the extracted part
-                # This handles formats like "B. Năm 1397" or just "B"
-                # Use ^[A-D] to match only if it starts with the letter after the colon and space
-                match = re.search(r'^[A-D]', answer_part)
-                if match:
-                    correct_answer_letter = match.group(0) # Store the found letter
-                    # print(f"Debug: Captured correct answer letter: {correct_answer_letter}") # Optional debug
-                else:
-                     # Handle case where correct answer format is unexpected
-                     print(f"Warning: Could not extract correct answer letter from '{text}'. Setting correct_answer_letter to None.")
-                     correct_answer_letter = None # Set to None if not found
-
-                continue # Move to the next line
-
-            # 7. Explanation
-            # Must start with "Giai thich:" or "Giải thích:"
-            elif text.startswith(('Giai thich:', 'Giải thích:')):
-                 explanation_text = text.split(':', 1)[1].strip() if ':' in text else ""
-                 # Append the reference link if one was captured for this heritage
-                 if reference_link:
-                     # Append the link text itself as requested
-                     current_question['explanation'] = explanation_text + " " + reference_link
-                 else:
-                     current_question['explanation'] = explanation_text
-                 # print(f"Debug: Captured explanation: '{current_question['explanation']}'") # Optional debug
-
-                 # After explanation, we assume the question block is finished (unless separator follows).
-                 # The logic handles this by finishing the question when the next "Câu hỏi N:" or "-----" is met.
-                 # However, if a document ends right after an explanation, we need the finalization after the loop.
-
-                 continue # Move to the next line
-
-            # If a line is within a question block and current_question is not None,
-            # AND it didn't match any specific pattern (Option, Answer, Explanation),
-            # it's likely unexpected formatting or stray text. We ignore it.
-            # print(f"Debug: Ignoring unhandled line within question context: '{text}'")
-
-
-    # --- After the loop finishes, finalize the very last question ---
-    # This is necessary if the file doesn't end with a separator or new Heritage block
-    if current_quiz and current_question:
-         finalize_and_add_question(
-            quiz_obj=current_quiz,
-            question_obj=current_question,
-            options_text_map=current_options_text,
-            correct_letter=correct_answer_letter
-         )
-
-    return quizzes
+    Args:
+        lines_list: A list (or any iterable) of strings, where each string is
+                    a line or paragraph from the document.
+
+    Returns:
+        A list of dictionaries, each representing a complete quiz object
+        in the target JSON structure.
+    """
+    return list(parse_quiz_stream(lines_list))
 
 # --- File Reading Functions ---
 
-def read_docx_file(docx_file_bytes: bytes) -> list[str]:
-    """Reads a docx file and returns a list of paragraph texts."""
+# Namespaced tag names used by the streaming DOCX reader (WordprocessingML, word/document.xml)
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_P = '{%s}p' % W_NS
+W_TBL = '{%s}tbl' % W_NS
+W_BODY = '{%s}body' % W_NS
+W_TC = '{%s}tc' % W_NS
+W_R = '{%s}r' % W_NS
+W_HYPERLINK = '{%s}hyperlink' % W_NS
+W_T = '{%s}t' % W_NS
+W_BR_TYPE = '{%s}type' % W_NS
+# Text equivalents of run content elements other than <w:t>, as python-docx renders them
+W_RUN_SPECIAL_TEXT = {
+    '{%s}tab' % W_NS: '\t',
+    '{%s}ptab' % W_NS: '\t',
+    '{%s}cr' % W_NS: '\n',
+    '{%s}noBreakHyphen' % W_NS: '-',
+}
+W_BR = '{%s}br' % W_NS
+
+
+def docx_run_text(run):
+    """Returns the text of a <w:r> element (same rules as python-docx's Run.text)."""
+    texts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            texts.append(child.text or '')
+        elif tag == W_BR:
+            # Line breaks become newlines; page and column breaks are dropped
+            if child.get(W_BR_TYPE, 'textWrapping') == 'textWrapping':
+                texts.append('\n')
+        else:
+            texts.append(W_RUN_SPECIAL_TEXT.get(tag, ''))
+    return ''.join(texts)
+
+
+def docx_paragraph_text(paragraph):
+    """Returns the text of a <w:p> element: its runs and the runs of its hyperlinks."""
+    texts = []
+    for child in paragraph:
+        if child.tag == W_R:
+            texts.append(docx_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            texts.extend(docx_run_text(run) for run in child if run.tag == W_R)
+    return ''.join(texts)
+
+
+def iter_docx_lines(docx_file_bytes: bytes):
+    """
+    Streams the paragraph texts of a DOCX file in document order.
+
+    Opens the DOCX zip and incrementally parses word/document.xml with lxml's
+    iterparse, without building python-docx objects. Yields the body
+    paragraphs (like `document.paragraphs`) and also the paragraphs inside
+    table cells, which python-docx's paragraph list leaves out. Finished
+    top-level paragraphs and tables are cleared as the parser moves on.
+    """
+    from lxml import etree
+
+    with zipfile.ZipFile(io.BytesIO(docx_file_bytes)) as docx_zip:
+        with docx_zip.open('word/document.xml') as document_xml:
+            for _event, element in etree.iterparse(document_xml, events=('end',), tag=(W_P, W_TBL),
+                                                   resolve_entities=False):
+                parent = element.getparent()
+                parent_tag = parent.tag if parent is not None else None
+                if element.tag == W_P and parent_tag in (W_BODY, W_TC):
+                    yield docx_paragraph_text(element)
+                # Paragraphs elsewhere (text boxes, content controls...) are skipped like python-docx does
+                if parent_tag == W_BODY:
+                    # Free this top-level paragraph/table and everything before it in the body
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del parent[0]
+
+
+def read_docx_file_python_docx(docx_file_bytes: bytes) -> list[str]:
+    """Reads a docx file with python-docx. Slower fallback for read_docx_file; skips tables."""
+    import docx
+
     try:
         document = docx.Document(io.BytesIO(docx_file_bytes))
         return [paragraph.text for paragraph in document.paragraphs]
@@ -332,17 +407,73 @@ def read_docx_file(docx_file_bytes: bytes) -> list[str]:
         raise ValueError(f"Error reading DOCX file: {e}")
 
 
+def read_docx_file(docx_file_bytes: bytes) -> list[str]:
+    """
+    Reads a docx file and returns a list of paragraph texts, including the
+    paragraphs inside tables, in document order. Uses the streaming reader
+    and falls back to python-docx if the file cannot be streamed.
+    """
+    try:
+        return list(iter_docx_lines(docx_file_bytes))
+    except Exception:
+        return read_docx_file_python_docx(docx_file_bytes)
+
+
+# Namespaced tag names used by the streaming ODT reader (ODF 1.2, content.xml)
+ODF_TEXT_NS = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+ODF_OFFICE_NS = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+ODF_PARAGRAPH_TAGS = ('{%s}p' % ODF_TEXT_NS, '{%s}h' % ODF_TEXT_NS)
+ODF_BODY_TEXT_TAG = '{%s}text' % ODF_OFFICE_NS
+
+
+def iter_odt_lines(odt_file_bytes: bytes):
+    """
+    Streams the paragraph and heading texts of an ODT file.
+
+    Opens the ODT zip and incrementally parses content.xml with lxml's
+    iterparse instead of building the whole odfpy document tree. Only the
+    paragraphs/headings directly under <office:text> are yielded (the same
+    ones read_odt_file_odfpy returns), stripped and skipping empty ones.
+    Finished elements are cleared as the parser moves on, so memory stays
+    flat regardless of the document size.
+    """
+    from lxml import etree
+
+    with zipfile.ZipFile(io.BytesIO(odt_file_bytes)) as odt_zip:
+        with odt_zip.open('content.xml') as content_xml:
+            for _event, element in etree.iterparse(content_xml, events=('end',), tag=ODF_PARAGRAPH_TAGS,
+                                                   resolve_entities=False):
+                parent = element.getparent()
+                if parent is None or parent.tag != ODF_BODY_TEXT_TAG:
+                    # Paragraph inside a table, list, frame...: skipped like the odfpy reader does.
+                    # It is freed together with its top-level ancestor below.
+                    continue
+                paragraph_text = ''.join(element.itertext()).strip()
+                # Free this paragraph and everything before it in the body
+                element.clear()
+                while element.getprevious() is not None:
+                    del parent[0]
+                if paragraph_text:
+                    yield paragraph_text
+
+
 def extract_text_recursive(element):
-    """Recursively extracts all text from an ODF element and its children."""
+    """Extracts all text from an ODF element and its children (depth-first, without recursion)."""
     texts = []
-    if hasattr(element, 'data') and element.data:
-        texts.append(element.data)
-    for child in getattr(element, 'childNodes', []):
-        texts.append(extract_text_recursive(child))
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        if hasattr(node, 'data') and node.data:
+            texts.append(node.data)
+        # Push children in reverse so they are visited in document order
+        stack.extend(reversed(getattr(node, 'childNodes', [])))
     return ''.join(texts)
 
-def read_odt_file(odt_file_bytes: bytes) -> list[str]:
-    """Reads an ODT file and returns a list of text contents from paragraphs and headings."""
+
+def read_odt_file_odfpy(odt_file_bytes: bytes) -> list[str]:
+    """Reads an ODT file with the odfpy DOM loader. Slower fallback for read_odt_file."""
+    from odf import opendocument
+
     lines = []
     try:
         document = opendocument.load(io.BytesIO(odt_file_bytes))
@@ -356,6 +487,17 @@ def read_odt_file(odt_file_bytes: bytes) -> list[str]:
     return lines
 
 
+def read_odt_file(odt_file_bytes: bytes) -> list[str]:
+    """
+    Reads an ODT file and returns a list of text contents from paragraphs and headings.
+    Uses the streaming reader and falls back to odfpy if the file cannot be streamed.
+    """
+    try:
+        return list(iter_odt_lines(odt_file_bytes))
+    except Exception:
+        return read_odt_file_odfpy(odt_file_bytes)
+
+
 def read_txt_file(txt_file_bytes: bytes) -> list[str]:
     """Reads a txt file and returns a list of lines."""
     try:
@@ -371,3 +513,26 @@ def read_txt_file(txt_file_bytes: bytes) -> list[str]:
     # Split content into lines, keeping line breaks might be useful or not,
     # strip() later handles leading/trailing whitespace. splitlines() is good.
     return content.splitlines()
+
+
+# Map of supported file extensions to their reader functions.
+# Every reader takes the raw file bytes and returns a list of text lines.
+FILE_READERS = {
+    '.docx': read_docx_file,
+    '.odt': read_odt_file,
+    '.txt': read_txt_file,
+}
+
+
+def read_quiz_file(file_bytes: bytes, file_extension: str) -> list[str]:
+    """
+    Picks the reader matching `file_extension` (e.g. '.odt') and returns the
+    list of text lines of the file.
+
+    Raises:
+        ValueError: if the extension is not supported or the file cannot be decoded.
+    """
+    reader = FILE_READERS.get(file_extension.lower())
+    if reader is None:
+        raise ValueError(f"Unsupported file format: {file_extension}")
+    return reader(file_bytes)
@@ -0,0 +1,112 @@
+"""
+Cache for the quiz read API (GET /quizzes/{heritageId} and GET /quizzes).
+
+Responses are cached already serialized, together with a strong ETag (a hash
+of the exact body bytes), so a hit costs neither a database query nor JSON
+encoding, and a client revalidating with If-None-Match gets a bodyless 304.
+
+Entries expire after QUIZ_CACHE_TTL seconds and the cache keeps at most
+QUIZ_CACHE_SIZE quizzes (and as many list pages) in LRU order. Writes from
+the upload path invalidate the written heritageIds and every list page; the
+TTL bounds staleness for writes made by other processes (e.g. ingest.py).
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from fastapi.responses import Response
+
+import settings
+from cache import LRUCache
+from metrics import QUIZ_READ_CACHE
+
+QUIZ_CACHE_TTL = settings.get_float("QUIZ_CACHE_TTL", 60)
+QUIZ_CACHE_SIZE = settings.get_int("QUIZ_CACHE_SIZE", 1024)
+
+# Clients must revalidate before reusing a response, which is cheap with the ETag
+CACHE_CONTROL = "no-cache"
+
+CachedBody = namedtuple("CachedBody", ["body", "etag", "expires_at"])
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag of a serialized response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header value matches `etag` (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class QuizReadCache:
+    """
+    TTL + LRU cache of serialized quiz responses.
+
+    `generation` is bumped by every invalidation. Readers take it before
+    querying the database and hand it back to put_*(); a result read before a
+    concurrent write is then dropped instead of caching the old document.
+    """
+
+    def __init__(self, max_entries=QUIZ_CACHE_SIZE, ttl=QUIZ_CACHE_TTL):
+        self.ttl = ttl
+        self._quizzes = LRUCache(max_entries)
+        self._pages = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def _get(self, store, key):
+        entry = store.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            store.pop(key)
+            entry = None
+        QUIZ_READ_CACHE.inc(result="miss" if entry is None else "hit")
+        return entry
+
+    def _put(self, store, key, body, generation):
+        entry = CachedBody(body, make_etag(body), time.monotonic() + self.ttl)
+        with self._lock:
+            if generation == self.generation:
+                store.put(key, entry)
+        return entry
+
+    def get_quiz(self, heritage_id):
+        return self._get(self._quizzes, heritage_id)
+
+    def put_quiz(self, heritage_id, body, generation):
+        return self._put(self._quizzes, heritage_id, body, generation)
+
+    def get_page(self, skip, limit):
+        return self._get(self._pages, (skip, limit))
+
+    def put_page(self, skip, limit, body, generation):
+        return self._put(self._pages, (skip, limit), body, generation)
+
+    def invalidate(self, heritage_ids):
+        """Drops the cached quizzes of `heritage_ids` and every cached list page."""
+        with self._lock:
+            self.generation += 1
+            for heritage_id in heritage_ids:
+                self._quizzes.pop(heritage_id)
+            self._pages.clear()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._quizzes.clear()
+            self._pages.clear()
+
+
+def cached_response(request, entry: CachedBody) -> Response:
+    """Returns the cached body, or an empty 304 when the client already has this ETag."""
+    headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
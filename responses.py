@@ -0,0 +1,59 @@
+"""
+Response classes that serialize quiz documents straight to JSON.
+
+The json C encoder walks the quiz tree once and calls `_json_default` only
+for the ObjectIds it meets, so there is no intermediate copy of the tree
+(as convert_objectid_to_str makes) and no second pass through FastAPI's
+jsonable_encoder.
+"""
+import json
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _json_default(value):
+    # Only ObjectIds (and other unknown types) get here, so bson is imported lazily
+    from bson import ObjectId
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_quiz(content) -> bytes:
+    """Serializes a quiz document (or list of them) to compact UTF-8 JSON, ObjectIds as strings."""
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=_json_default,
+    ).encode("utf-8")
+
+
+class QuizJSONResponse(JSONResponse):
+    """JSON response for quiz documents with native ObjectId handling."""
+
+    def render(self, content) -> bytes:
+        return dumps_quiz(content)
+
+
+def iter_ndjson(quizzes):
+    """Yields one serialized quiz per line."""
+    for quiz in quizzes:
+        yield dumps_quiz(quiz) + b"\n"
+
+
+class QuizNDJSONResponse(StreamingResponse):
+    """Streams quizzes as newline-delimited JSON, one quiz per line."""
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    def __init__(self, quizzes, status_code=200, headers=None):
+        super().__init__(iter_ndjson(quizzes), status_code=status_code, headers=headers, media_type=self.media_type)
+
+
+def wants_ndjson(request) -> bool:
+    """True when the client asked for NDJSON through its Accept header."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
@@ -0,0 +1,300 @@
+"""
+Grading of quiz submissions and write-behind aggregation of quiz stats.
+
+Submissions are graded in memory against an answer-key index
+(questionId -> correct optionId per heritage), built from the uploads as
+they are saved or written by the journal and loaded from MongoDB on first
+use. Like the read cache, keys expire after QUIZ_CACHE_TTL seconds, and a key is reloaded early when a
+submission names questionIds it does not know, so writes made by other
+processes (e.g. ingest.py re-minting questionIds) are picked up. Per-quiz stats and the
+best submissions are accumulated in memory and flushed to MongoDB every
+STATS_FLUSH_INTERVAL seconds as one bulk write, with one UpdateOne per quiz:
+
+  * counters are applied with $inc, so concurrent flushes (from several
+    processes, or after a retry) add up instead of overwriting each other;
+  * topPerformers is merged with $push/$each/$sort/$slice, keeping the
+    best `topPerformersLimit` entries in the document.
+
+No request ever does a read-modify-write of the quiz document. Aggregates of
+a quiz that is not in MongoDB yet (still in the write-behind journal) are
+kept for a later flush. Like the journal, this assumes a single API process
+per quiz: aggregates not yet flushed are lost if the process is killed.
+"""
+import heapq
+import logging
+import threading
+import time
+
+import settings
+from metrics import SUBMISSIONS
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = settings.get_float("STATS_FLUSH_INTERVAL", 5.0)
+# Answer keys expire like the read cache's entries
+ANSWER_KEY_TTL = settings.get_float("QUIZ_CACHE_TTL", 60)
+DEFAULT_TOP_PERFORMERS_LIMIT = 10
+# A key is not reloaded for unknown questionIds more often than this (seconds)
+ANSWER_KEY_MIN_RELOAD_INTERVAL = 1.0
+
+# Fields needed to build an answer key
+ANSWER_KEY_PROJECTION = {"_id": 0, "heritageId": 1, "topPerformersLimit": 1,
+                         "questions.questionId": 1, "questions.options.optionId": 1,
+                         "questions.options.isCorrect": 1}
+
+
+class AnswerKey:
+    __slots__ = ("heritage_id", "answers", "top_limit", "loaded_at")
+
+    def __init__(self, heritage_id, answers, top_limit):
+        self.heritage_id = heritage_id
+        self.answers = answers      # {questionId: correct optionId (or None)}
+        self.top_limit = top_limit
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_quiz(cls, quiz):
+        answers = {}
+        for question in quiz.get("questions", []):
+            correct = next((option["optionId"] for option in question.get("options", []) if option.get("isCorrect")), None)
+            answers[str(question["questionId"])] = correct
+        return cls(quiz["heritageId"], answers, quiz.get("topPerformersLimit") or DEFAULT_TOP_PERFORMERS_LIMIT)
+
+
+class AnswerKeyIndex:
+    """
+    heritageId -> AnswerKey, filled from uploads and loaded from MongoDB on a
+    miss. Keys expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=ANSWER_KEY_TTL):
+        self.ttl = ttl
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, heritage_id, question_ids=()):
+        """
+        Returns the answer key of a heritage, or None when it must be (re)loaded:
+        it is unknown, expired, or does not know some of `question_ids` (the
+        questions of a submission) and was not loaded in the last moment.
+        """
+        key = self._keys.get(heritage_id)
+        if key is None:
+            return None
+        age = time.monotonic() - key.loaded_at
+        if age > self.ttl:
+            return None
+        if age > ANSWER_KEY_MIN_RELOAD_INTERVAL and any(question_id not in key.answers for question_id in question_ids):
+            return None
+        return key
+
+    def update(self, quizzes):
+        """Indexes the answer keys of freshly uploaded quizzes."""
+        keys = [AnswerKey.from_quiz(quiz) for quiz in quizzes]
+        with self._lock:
+            for key in keys:
+                self._keys[key.heritage_id] = key
+
+    def load(self, heritage_id, collection=None):
+        """Loads one answer key from MongoDB (blocking). Returns None if the quiz does not exist."""
+        if collection is None:
+            from db import get_collection
+            collection = get_collection()
+        started = time.monotonic()
+        quiz = collection.find_one({"heritageId": heritage_id}, ANSWER_KEY_PROJECTION)
+        with self._lock:
+            current = self._keys.get(heritage_id)
+            if current is not None and current.loaded_at >= started:
+                # An upload indexed while we were reading wins over the stored version
+                return current
+            if quiz is None:
+                # Not in MongoDB (yet): an uploaded quiz still in the write-behind journal keeps its key
+                return current
+            key = self._keys[heritage_id] = AnswerKey.from_quiz(quiz)
+            return key
+
+
+class QuizAggregate:
+    """Stats accumulated for one quiz since the last flush."""
+    __slots__ = ("attempts", "correct", "answered", "perfect", "questions", "top", "top_limit", "last_at")
+
+    def __init__(self, top_limit):
+        self.attempts = 0
+        self.correct = 0
+        self.answered = 0
+        self.perfect = 0
+        self.questions = {}   # {questionId: [answered, correct]}
+        self.top = []         # min-heap of (sort key, -sequence, entry), at most top_limit long
+        self.top_limit = top_limit
+        self.last_at = 0
+
+
+class Scoreboard:
+    """
+    Grades submissions and keeps per-quiz aggregates until the next flush.
+
+    Args:
+        collection: Collection the aggregates are flushed to (default: the shared one).
+    """
+
+    def __init__(self, collection=None, flush_interval=STATS_FLUSH_INTERVAL):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._aggregates = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, key, user_id, answers, user_name="", duration_seconds=None):
+        """
+        Grades one submission against `key` and adds it to the quiz aggregate.
+
+        Args:
+            answers: {questionId: chosen optionId}. Unknown questions are ignored.
+
+        Returns:
+            The graded result returned to the client.
+        """
+        results = {question_id: answers.get(question_id) == correct and correct is not None
+                   for question_id, correct in key.answers.items()}
+        correct = sum(results.values())
+        total = len(results)
+        now = int(time.time())
+        entry = {"userId": user_id, "userName": user_name, "score": correct, "total": total,
+                 "durationSeconds": duration_seconds, "submittedAt": now}
+        # Higher score first, then earlier (the same order as the $sort of the flush)
+        rank = (correct, -now)
+
+        with self._lock:
+            aggregate = self._aggregates.get(key.heritage_id)
+            if aggregate is None:
+                aggregate = self._aggregates[key.heritage_id] = QuizAggregate(key.top_limit)
+            aggregate.attempts += 1
+            aggregate.correct += correct
+            aggregate.answered += sum(1 for question_id in results if question_id in answers)
+            aggregate.perfect += correct == total and total > 0
+            aggregate.last_at = now
+            for question_id, is_correct in results.items():
+                if question_id in answers:
+                    counts = aggregate.questions.setdefault(question_id, [0, 0])
+                    counts[0] += 1
+                    counts[1] += is_correct
+            self._sequence += 1
+            item = (rank, -self._sequence, entry)  # on a tie the earlier submission ranks higher
+            if len(aggregate.top) < aggregate.top_limit:
+                heapq.heappush(aggregate.top, item)
+            elif item > aggregate.top[0]:
+                heapq.heapreplace(aggregate.top, item)
+        SUBMISSIONS.inc()
+
+        return {"heritageId": key.heritage_id, "correct": correct, "total": total,
+                "score": round(100 * correct / total, 2) if total else 0.0, "results": results}
+
+    # --- Flushing ---
+
+    @staticmethod
+    def build_update(heritage_id, aggregate):
+        from pymongo import UpdateOne
+
+        increments = {
+            "stats.attempts": aggregate.attempts,
+            "stats.totalCorrect": aggregate.correct,
+            "stats.totalAnswered": aggregate.answered,
+            "stats.perfectScores": aggregate.perfect,
+        }
+        for question_id, (answered, correct) in aggregate.questions.items():
+            increments[f"stats.questions.{question_id}.answered"] = answered
+            increments[f"stats.questions.{question_id}.correct"] = correct
+        top = [entry for _rank, _sequence, entry in sorted(aggregate.top, reverse=True)]
+        return UpdateOne(
+            {"heritageId": heritage_id},
+            {
+                "$inc": increments,
+                "$max": {"stats.lastSubmissionAt": aggregate.last_at},
+                "$push": {"topPerformers": {
+                    "$each": top,
+                    "$sort": {"score": -1, "submittedAt": 1},
+                    "$slice": aggregate.top_limit,
+                }},
+            },
+        )
+
+    def _merge_back(self, aggregates):
+        """Puts the aggregates of a failed flush back, so they go out with the next one."""
+        with self._lock:
+            for heritage_id, old in aggregates.items():
+                current = self._aggregates.get(heritage_id)
+                if current is None:
+                    self._aggregates[heritage_id] = old
+                    continue
+                current.attempts += old.attempts
+                current.correct += old.correct
+                current.answered += old.answered
+                current.perfect += old.perfect
+                current.last_at = max(current.last_at, old.last_at)
+                for question_id, (answered, correct) in old.questions.items():
+                    counts = current.questions.setdefault(question_id, [0, 0])
+                    counts[0] += answered
+                    counts[1] += correct
+                for item in old.top:
+                    if len(current.top) < current.top_limit:
+                        heapq.heappush(current.top, item)
+                    elif item > current.top[0]:
+                        heapq.heapreplace(current.top, item)
+
+    def flush(self):
+        """Writes the accumulated aggregates with one bulk write. Returns the number of quizzes written."""
+        with self._lock:
+            aggregates, self._aggregates = self._aggregates, {}
+        if not aggregates:
+            return 0
+        collection = self.collection
+        if collection is None:
+            from db import get_collection
+            collection = get_collection()
+        try:
+            # A quiz that was just uploaded may still be in the write-behind journal;
+            # keep its aggregate for a later flush rather than updating nothing
+            stored = {doc["heritageId"] for doc in collection.find(
+                {"heritageId": {"$in": list(aggregates)}}, {"_id": 0, "heritageId": 1})}
+        except Exception as e:
+            logger.warning(f"Stats flush of {len(aggregates)} quizzes failed, retrying at the next flush: {e}")
+            self._merge_back(aggregates)
+            raise
+        deferred = {heritage_id: aggregates.pop(heritage_id) for heritage_id in list(aggregates)
+                    if heritage_id not in stored}
+        self._merge_back(deferred)
+        if not aggregates:
+            return 0
+        try:
+            collection.bulk_write([self.build_update(heritage_id, aggregate)
+                                   for heritage_id, aggregate in aggregates.items()], ordered=False)
+        except Exception as e:
+            logger.warning(f"Stats flush of {len(aggregates)} quizzes failed, retrying at the next flush: {e}")
+            self._merge_back(aggregates)
+            raise
+        return len(aggregates)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-flusher", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """Stops the periodic flushes and writes what is left."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Final stats flush failed, {len(self._aggregates)} quiz aggregates lost: {e}")
@@ -0,0 +1,409 @@
+"""
+Full-text search over the question bank.
+
+An in-memory inverted index over every question's content, option texts and
+explanation. Text is NFC-normalized and segmented with underthesea
+(parser.tokenize_text), then indexed as:
+
+  * accent-folded syllables ("ho", "chi", "minh"), so "Ho Chi Minh" finds
+    "Hồ Chí Minh";
+  * accent-folded syllable bigrams ("ho chi", "chi minh"), which rank
+    phrase matches first;
+  * the exact accented words as segmented by underthesea ("=hồ",
+    "=chí minh"), which rank exact matches first when the query has accents.
+
+Syllables rather than segmented words are the matching unit because
+underthesea segments the same phrase differently with and without accents.
+Results are ranked with BM25.
+
+Postings are one array('I') per term of interleaved (document, weighted term
+frequency) pairs. The index is updated incrementally by uploads (a
+re-uploaded heritage replaces its questions) and saved as a compressed
+snapshot (SEARCH_SNAPSHOT_PATH). At startup the snapshot is loaded and only
+the quizzes updated since it was written are read from MongoDB; without a
+usable snapshot the index is rebuilt from the whole collection.
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import zlib
+from array import array
+
+import settings
+from parser import OPTION_PREFIX, fold_accents, load_word_tokenize, tokenize_text
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SNAPSHOT_PATH = settings.get_str("SEARCH_SNAPSHOT_PATH", "search_index.snapshot")  # "" disables snapshots
+SEARCH_SNAPSHOT_INTERVAL = settings.get_float("SEARCH_SNAPSHOT_INTERVAL", 300.0)  # seconds between snapshots
+# Bump whenever the analysis below changes, so older snapshots are rebuilt
+SEARCH_INDEX_VERSION = 1
+SNAPSHOT_MAGIC = b"QSEARCH1\n"
+
+# Weighted term frequency of each field: matches in the explanation count half
+FIELD_WEIGHTS = {"content": 2, "options": 2, "explanation": 1}
+EXACT_PREFIX = "="
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Dead documents (replaced by re-uploads) are compacted away past this many
+COMPACT_MIN_DEAD = 1000
+
+# Fields read from MongoDB to (re)build the index
+SEARCH_PROJECTION = {"_id": 0, "heritageId": 1, "updatedAt": 1, "questions.questionId": 1,
+                     "questions.content": 1, "questions.options.optionText": 1, "questions.explanation": 1}
+
+
+def analyze(text):
+    """Index terms of `text`: folded syllables, folded syllable bigrams and exact accented words."""
+    terms = []
+    syllables = []
+    for word in tokenize_text(text):
+        folded = fold_accents(word)
+        if folded != word:
+            terms.append(EXACT_PREFIX + word)
+        syllables.extend(folded.split())
+    terms.extend(syllables)
+    terms.extend(f"{first} {second}" for first, second in zip(syllables, syllables[1:]))
+    return terms
+
+
+def question_terms(question):
+    """{term: weighted frequency} of one question."""
+    options = " ".join(OPTION_PREFIX.sub("", option.get("optionText", "")) for option in question.get("options", []))
+    counts = {}
+    for field, text in (("content", question.get("content", "")), ("options", options),
+                        ("explanation", question.get("explanation", ""))):
+        weight = FIELD_WEIGHTS[field]
+        for term in analyze(text or ""):
+            counts[term] = counts.get(term, 0) + weight
+    return counts
+
+
+def segmenter_name():
+    return "underthesea" if load_word_tokenize() else "whitespace"
+
+
+class SearchIndex:
+    """
+    Args:
+        snapshot_path: Snapshot file, or None/"" to always rebuild from MongoDB.
+    """
+
+    def __init__(self, snapshot_path=SEARCH_SNAPSHOT_PATH, snapshot_interval=SEARCH_SNAPSHOT_INTERVAL):
+        self.snapshot_path = snapshot_path or None
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.RLock()
+        self._reset()
+        self._ready = False
+        self._early = []            # uploads indexed before the startup load finished
+        self._dirty = False
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _reset(self):
+        self._documents = []        # per document: [questionId, heritageId, content], None when dead
+        self._lengths = array("I")  # weighted term count per document
+        self._postings = {}         # term -> array('I') of interleaved (document, frequency)
+        self._docs_by_heritage = {}
+        self._total_length = 0
+        self._dead = 0
+        self._norms = None          # cached by _bm25_norms
+        self.watermark = 0          # newest updatedAt indexed
+
+    def __len__(self):
+        return len(self._documents) - self._dead
+
+    def _bm25_norms(self):
+        """BM25 length normalization of every document, recomputed after changes (lock held)."""
+        if self._norms is None:
+            average_length = self._total_length / max(1, len(self))
+            self._norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) for length in self._lengths]
+        return self._norms
+
+    @property
+    def ready(self):
+        return self._ready
+
+    # --- Updates ---
+
+    def add_quizzes(self, quizzes):
+        """Indexes uploaded quizzes, replacing earlier versions of the same heritages."""
+        with self._lock:
+            if not self._ready:
+                self._early.extend(quizzes)
+        self._index(quizzes)
+
+    def _index(self, quizzes):
+        prepared = [(quiz, [(question, question_terms(question)) for question in quiz.get("questions", [])])
+                    for quiz in quizzes]
+        with self._lock:
+            for quiz, questions in prepared:
+                heritage_id = quiz["heritageId"]
+                self._remove_heritage(heritage_id)
+                documents = []
+                for question, terms in questions:
+                    document = len(self._documents)
+                    self._documents.append([str(question["questionId"]), heritage_id, question.get("content", "")])
+                    length = sum(terms.values())
+                    self._lengths.append(length)
+                    self._total_length += length
+                    for term, frequency in terms.items():
+                        postings = self._postings.get(term)
+                        if postings is None:
+                            postings = self._postings[term] = array("I")
+                        postings.append(document)
+                        postings.append(frequency)
+                    documents.append(document)
+                self._docs_by_heritage[heritage_id] = documents
+                self.watermark = max(self.watermark, quiz.get("updatedAt") or 0)
+            if self._dead > COMPACT_MIN_DEAD and self._dead > len(self) // 4:
+                self._compact()
+            self._norms = None
+            self._dirty = True
+
+    def _remove_heritage(self, heritage_id):
+        for document in self._docs_by_heritage.pop(heritage_id, []):
+            if self._documents[document] is not None:
+                self._documents[document] = None
+                self._total_length -= self._lengths[document]
+                self._dead += 1
+
+    def _compact(self):
+        """Drops dead documents and renumbers the live ones (lock held)."""
+        remap = {}
+        documents = []
+        lengths = array("I")
+        for old, entry in enumerate(self._documents):
+            if entry is not None:
+                remap[old] = len(documents)
+                documents.append(entry)
+                lengths.append(self._lengths[old])
+        postings = {}
+        for term, old_postings in self._postings.items():
+            new_postings = array("I")
+            for i in range(0, len(old_postings), 2):
+                document = remap.get(old_postings[i])
+                if document is not None:
+                    new_postings.append(document)
+                    new_postings.append(old_postings[i + 1])
+            if new_postings:
+                postings[term] = new_postings
+        self._documents = documents
+        self._lengths = lengths
+        self._postings = postings
+        self._docs_by_heritage = {
+            heritage_id: [remap[document] for document in docs if document in remap]
+            for heritage_id, docs in self._docs_by_heritage.items()
+        }
+        self._dead = 0
+        self._norms = None
+
+    # --- Queries ---
+
+    def search(self, query, limit=20, heritage_id=None):
+        """
+        Returns the questions best matching `query`, as dicts with questionId,
+        heritageId, content and score, optionally within one heritage.
+        """
+        terms = set(analyze(query or ""))
+        if not terms:
+            return []
+        with self._lock:
+            count = len(self)
+            if count == 0:
+                return []
+            allowed = None
+            if heritage_id is not None:
+                allowed = set(self._docs_by_heritage.get(heritage_id, ()))
+            documents, norms = self._documents, self._bm25_norms()
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                pairs = zip(postings[0::2], postings[1::2])
+                if self._dead:
+                    # Postings of dead documents stay until the next compaction: skip them,
+                    # and count only the live ones in the document frequency
+                    pairs = [(document, tf) for document, tf in pairs if documents[document] is not None]
+                    frequency = len(pairs)
+                else:
+                    frequency = len(postings) // 2
+                if not frequency:
+                    continue
+                weight = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5)) * (BM25_K1 + 1)
+                get = scores.get
+                for document, tf in pairs:
+                    if allowed is None or document in allowed:
+                        scores[document] = get(document, 0.0) + weight * tf / (tf + norms[document])
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [{"questionId": documents[document][0], "heritageId": documents[document][1],
+                     "content": documents[document][2], "score": round(score, 4)}
+                    for document, score in best]
+
+    # --- Snapshots ---
+
+    def save_snapshot(self, path=None):
+        """Writes the index to `path` (default: snapshot_path) atomically. Returns False if disabled."""
+        path = path or self.snapshot_path
+        if not path:
+            return False
+        with self._lock:
+            if self._dead:
+                self._compact()
+            terms = list(self._postings)
+            offsets = array("Q", [0])
+            for postings in self._postings.values():
+                offsets.append(offsets[-1] + len(postings))
+            header = {
+                "version": SEARCH_INDEX_VERSION,
+                "segmenter": segmenter_name(),
+                "byteorder": sys.byteorder,
+                "watermark": self.watermark,
+                "documents": self._documents,
+                "terms": terms,
+            }
+            parts = [json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), b"\n",
+                     self._lengths.tobytes(), offsets.tobytes()]
+            parts.extend(postings.tobytes() for postings in self._postings.values())
+            self._dirty = False
+        data = SNAPSHOT_MAGIC + zlib.compress(b"".join(parts), 1)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    def load_snapshot(self, path=None):
+        """Replaces the index with the snapshot at `path`. Returns False if it is missing or unusable."""
+        path = path or self.snapshot_path
+        if not path:
+            return False
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not data.startswith(SNAPSHOT_MAGIC):
+                raise ValueError("not a search index snapshot")
+            payload = zlib.decompress(data[len(SNAPSHOT_MAGIC):])
+            newline = payload.index(b"\n")
+            header = json.loads(payload[:newline])
+            rest = memoryview(payload)[newline + 1:]
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable search index snapshot {path}: {e}")
+            return False
+        if (header.get("version") != SEARCH_INDEX_VERSION or header.get("segmenter") != segmenter_name()
+                or header.get("byteorder") != sys.byteorder):
+            logger.info(f"Search index snapshot {path} was built differently, rebuilding")
+            return False
+
+        documents = header["documents"]
+        terms = header["terms"]
+        lengths = array("I")
+        lengths.frombytes(rest[:len(documents) * lengths.itemsize])
+        rest = rest[len(documents) * lengths.itemsize:]
+        offsets = array("Q")
+        offsets.frombytes(rest[:(len(terms) + 1) * offsets.itemsize])
+        rest = rest[(len(terms) + 1) * offsets.itemsize:]
+        postings = {}
+        itemsize = array("I").itemsize
+        for i, term in enumerate(terms):
+            term_postings = array("I")
+            term_postings.frombytes(rest[offsets[i] * itemsize:offsets[i + 1] * itemsize])
+            postings[term] = term_postings
+
+        with self._lock:
+            self._reset()
+            self._documents = documents
+            self._lengths = lengths
+            self._postings = postings
+            for document, (_question_id, heritage_id, _content) in enumerate(documents):
+                self._docs_by_heritage.setdefault(heritage_id, []).append(document)
+            self._total_length = sum(lengths)
+            self.watermark = header.get("watermark", 0)
+        return True
+
+    # --- Loading ---
+
+    def _add_from_cursor(self, cursor, batch_size=500):
+        batch = []
+        for quiz in cursor:
+            if self._stopping.is_set():
+                return
+            batch.append(quiz)
+            if len(batch) >= batch_size:
+                self._index(batch)
+                batch = []
+        self._index(batch)
+
+    def load(self, collection):
+        """
+        Builds the index at startup: loads the snapshot and catches up on the
+        quizzes updated since, or rebuilds everything from `collection`.
+        Uploads indexed in the meantime are re-applied on top.
+        """
+        if self.load_snapshot():
+            # updatedAt has a one-second resolution: include the watermark's second again
+            query = {"updatedAt": {"$gte": self.watermark}}
+            logger.info(f"Search index snapshot loaded with {len(self)} questions")
+        else:
+            with self._lock:
+                self._reset()
+            query = {}
+        self._add_from_cursor(collection.find(query, SEARCH_PROJECTION))
+        with self._lock:
+            early, self._early = self._early, []
+            self._ready = True
+        self._index(early)
+        with self._lock:
+            # The catch-up re-indexes quizzes that were already in the snapshot
+            if self._dead:
+                self._compact()
+
+    def _run(self, collection):
+        try:
+            self.load(collection)
+            logger.info(f"Search index ready with {len(self)} questions")
+            if self._dirty:
+                self.save_snapshot()
+        except Exception as e:
+            logger.error(f"Failed to load the search index: {e}")
+        while not self._stopping.wait(self.snapshot_interval):
+            self._save_if_dirty()
+
+    def _save_if_dirty(self):
+        if not (self._ready and self._dirty):
+            return
+        try:
+            self.save_snapshot()
+        except Exception as e:
+            logger.error(f"Failed to write the search index snapshot: {e}")
+
+    def start(self, collection=None):
+        """Loads the index in the background, then snapshots it every snapshot_interval seconds."""
+        if collection is None:
+            from db import get_collection
+            collection = get_collection()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(collection,), name="search-index", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=30.0):
+        """Stops the background thread and writes a last snapshot if the index changed."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._save_if_dirty()
@@ -0,0 +1,42 @@
+"""
+Process-wide configuration, resolved once at import.
+
+The .env file is read from one known location (the application directory,
+or the path in ENV_FILE) instead of searching up the filesystem, and
+python-dotenv is only imported when that file exists. Values from .env
+override the process environment, as they always have.
+
+Modules read their settings through get_str/get_int/get_float, which
+guarantees the .env file has been loaded before the first lookup.
+"""
+import os
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_FILE = os.getenv("ENV_FILE") or os.path.join(APP_DIR, ".env")
+
+
+def load_env_file(path=ENV_FILE):
+    """Loads `path` into os.environ if it exists. Returns True when a file was loaded."""
+    if not os.path.isfile(path):
+        return False
+    from dotenv import load_dotenv
+    return load_dotenv(path, override=True)
+
+
+load_env_file()
+
+# Runtime state that must survive restarts (the upload journal), kept out of the source tree
+STATE_DIR = os.getenv("STATE_DIR") or os.path.join(
+    os.getenv("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"), "history-heritage")
+
+
+def get_str(name, default=None):
+    return os.getenv(name, default)
+
+
+def get_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def get_float(name, default):
+    return float(os.getenv(name, str(default)))
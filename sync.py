@@ -0,0 +1,210 @@
+"""
+Incremental re-ingest support.
+
+* FileManifest remembers path, mtime, size and SHA-256 of every ingested file,
+  so a sync only re-reads the files that actually changed.
+* sync_quizzes diffs freshly parsed quizzes against the stored quiz of the
+  same heritageId, matching questions by their normalized content, and sends
+  minimal $pull/$set/$push updates. Unchanged questions keep their questionId.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from db import BULK_BATCH_SIZE, build_upsert, get_collection
+from parser import simple_normalize
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """JSON manifest of ingested files: {path: {"mtime", "size", "sha256"}}."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data.get("files", {})
+
+    def changed(self, paths):
+        """
+        Returns the subset of `paths` whose content changed since the last sync.
+        Files whose mtime/size changed but whose hash did not are only re-stamped.
+        """
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.files.get(path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            sha256 = file_sha256(path)
+            if entry and entry["sha256"] == sha256:
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                continue
+            changed.append(path)
+        return changed
+
+    def record(self, path):
+        """Marks `path` as ingested in its current state."""
+        stat = os.stat(path)
+        self.files[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": file_sha256(path)}
+
+    def forget_missing(self, paths):
+        """Drops entries for files that are no longer present. Their quizzes stay in the database."""
+        present = set(paths)
+        for path in list(self.files):
+            if path not in present:
+                del self.files[path]
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def question_key(question):
+    """Identity of a question across edits: its normalized, case-folded content."""
+    return simple_normalize(question.get("content", "")).casefold()
+
+
+def _option_values(question):
+    return [(option["optionText"], option["isCorrect"]) for option in question.get("options", [])]
+
+
+def _merge_options(stored, parsed):
+    """Parsed options, reusing the stored optionIds position by position."""
+    stored_options = stored.get("options", [])
+    merged = []
+    for index, option in enumerate(parsed.get("options", [])):
+        option = dict(option)
+        if index < len(stored_options):
+            option["optionId"] = stored_options[index]["optionId"]
+        merged.append(option)
+    return merged
+
+
+def diff_quiz(stored, parsed):
+    """
+    Builds the minimal updates turning the `stored` quiz document into `parsed`.
+    The parsed quiz is modified in place to carry the stored ids.
+
+    Returns:
+        (operations, stats) where operations is a list of UpdateOne, to be sent in
+        order, and stats counts added/removed/changed questions.
+    """
+    # Imported here so the manifest side of this module (and --dry-run) works without pymongo
+    from pymongo import UpdateOne
+
+    stats = {"questionsAdded": 0, "questionsRemoved": 0, "questionsChanged": 0}
+    if stored is None:
+        stats["questionsAdded"] = len(parsed["questions"])
+        return [build_upsert(parsed)], stats
+
+    parsed["_id"] = stored["_id"]
+    stored_by_key = {}
+    for question in stored.get("questions", []):
+        stored_by_key.setdefault(question_key(question), question)
+
+    heritage_filter = {"heritageId": parsed["heritageId"]}
+    set_fields = {}
+    array_filters = []
+    added = []
+    kept_ids = set()
+    for question in parsed["questions"]:
+        previous = stored_by_key.get(question_key(question))
+        if previous is None or previous["questionId"] in kept_ids:
+            added.append(question)
+            continue
+        kept_ids.add(previous["questionId"])
+        question["questionId"] = previous["questionId"]
+        question["options"] = _merge_options(previous, question)
+        if (_option_values(previous) == _option_values(question)
+                and [o["optionId"] for o in previous.get("options", [])] == [o["optionId"] for o in question["options"]]
+                and all(previous.get(field) == question.get(field) for field in ("content", "explanation", "image"))):
+            continue
+        # Update the changed question in place, addressed by its questionId
+        identifier = f"q{len(array_filters)}"
+        for field in ("content", "explanation", "image", "options"):
+            set_fields[f"questions.$[{identifier}].{field}"] = question[field]
+        array_filters.append({f"{identifier}.questionId": previous["questionId"]})
+        stats["questionsChanged"] += 1
+
+    removed = [q["questionId"] for q in stored.get("questions", []) if q["questionId"] not in kept_ids]
+    stats["questionsAdded"] = len(added)
+    stats["questionsRemoved"] = len(removed)
+
+    quiz_fields = {field: parsed[field] for field in ("title", "content") if stored.get(field) != parsed[field]}
+    if not (quiz_fields or set_fields or added or removed):
+        return [], stats
+
+    # $pull, $set on array elements and $push touch the same array, so MongoDB
+    # requires them in separate updates; they are sent in this order.
+    operations = []
+    if removed:
+        operations.append(UpdateOne(heritage_filter, {"$pull": {"questions": {"questionId": {"$in": removed}}}}))
+    quiz_fields["updatedAt"] = int(time.time())
+    set_fields.update(quiz_fields)
+    operations.append(UpdateOne(heritage_filter, {"$set": set_fields}, array_filters=array_filters or None))
+    if added:
+        operations.append(UpdateOne(heritage_filter, {"$push": {"questions": {"$each": added}}}))
+    return operations, stats
+
+
+def sync_quizzes(quizzes, collection=None):
+    """
+    Applies question-level diffs for `quizzes` against the stored documents
+    (one find for all heritageIds, then ordered bulk writes).
+
+    Returns:
+        Totals: quizzes inserted/updated/unchanged, questions added/removed/changed
+        and the number of write operations sent.
+    """
+    if collection is None:
+        collection = get_collection()
+    totals = {"quizzesInserted": 0, "quizzesUpdated": 0, "quizzesUnchanged": 0,
+              "questionsAdded": 0, "questionsRemoved": 0, "questionsChanged": 0, "operations": 0}
+    if not quizzes:
+        return totals
+
+    stored_quizzes = {
+        doc["heritageId"]: doc
+        for doc in collection.find(
+            {"heritageId": {"$in": [quiz["heritageId"] for quiz in quizzes]}},
+            {"heritageId": 1, "title": 1, "content": 1, "questions": 1},
+        )
+    }
+    operations = []
+    for quiz in quizzes:
+        stored = stored_quizzes.get(quiz["heritageId"])
+        quiz_operations, stats = diff_quiz(stored, quiz)
+        for key, value in stats.items():
+            totals[key] += value
+        if stored is None:
+            totals["quizzesInserted"] += 1
+            # A later quiz with the same heritageId in this batch diffs against this one
+            stored_quizzes[quiz["heritageId"]] = quiz
+        elif quiz_operations:
+            totals["quizzesUpdated"] += 1
+        else:
+            totals["quizzesUnchanged"] += 1
+        operations.extend(quiz_operations)
+
+    for start in range(0, len(operations), BULK_BATCH_SIZE):
+        collection.bulk_write(operations[start:start + BULK_BATCH_SIZE], ordered=True)
+    totals["operations"] = len(operations)
+    return totals
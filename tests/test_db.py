@@ -0,0 +1,63 @@
+"""
+db.bulk_upsert against the in-process FakeCollection: re-uploads keep what
+MongoDB already stores, and writes are split into BULK_BATCH_SIZE batches.
+"""
+from bson import ObjectId
+
+import db
+from benchmarks.fake_mongo import FakeCollection
+
+
+class RecordingCollection(FakeCollection):
+    """FakeCollection remembering the size of every bulk write."""
+
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.batch_sizes.append(len(requests))
+        return super().bulk_write(requests, ordered=ordered)
+
+
+def make_quiz(heritage_id, title="Đền Hùng", **fields):
+    return {"_id": ObjectId(), "heritageId": heritage_id, "title": title, "content": "", "questions": [],
+            "createdAt": 1, "stats": {"attempts": 0}, "status": "draft", **fields}
+
+
+def test_reupload_keeps_stored_id_and_insert_only_fields():
+    collection = FakeCollection()
+    first = make_quiz("den-hung", stats={"attempts": 7}, status="published")
+    db.bulk_upsert(collection, [first])
+
+    # A fresh parse of the edited file: new _id and default insert-only fields
+    second = make_quiz("den-hung", title="Khu di tích Đền Hùng", createdAt=2)
+    db.bulk_upsert(collection, [second])
+
+    assert second["_id"] == first["_id"]
+    stored = collection.find_one({"heritageId": "den-hung"})
+    assert stored["_id"] == first["_id"]
+    assert stored["title"] == "Khu di tích Đền Hùng"
+    assert (stored["createdAt"], stored["stats"], stored["status"]) == (1, {"attempts": 7}, "published")
+
+
+def test_new_and_existing_quizzes_in_one_write():
+    collection = FakeCollection()
+    existing = make_quiz("den-hung")
+    db.bulk_upsert(collection, [existing])
+
+    new, again = make_quiz("van-mieu"), make_quiz("den-hung")
+    new_id = new["_id"]
+    db.bulk_upsert(collection, [new, again])
+
+    assert new["_id"] == new_id
+    assert again["_id"] == existing["_id"]
+    assert {doc["_id"] for doc in collection.find({})} == {new_id, existing["_id"]}
+
+
+def test_writes_are_split_into_batches(monkeypatch):
+    monkeypatch.setattr(db, "BULK_BATCH_SIZE", 2)
+    collection = RecordingCollection()
+    db.bulk_upsert(collection, [make_quiz(f"heritage-{index}") for index in range(5)])
+    assert collection.batch_sizes == [2, 2, 1]
+    assert len(list(collection.find({}))) == 5
@@ -0,0 +1,23 @@
+"""
+`import main` must leave the heavy dependencies to first use. The timing
+budget is only checked when IMPORT_TIME_BUDGET_MS is set, since shared CI
+machines are too noisy for it.
+"""
+import os
+import statistics
+
+import pytest
+
+from benchmarks.import_time import IMPORT_TIME_BUDGET_MS, measure_import
+
+
+def test_import_main_loads_no_lazy_module():
+    _timings, loaded = measure_import(1)
+    assert loaded == []
+
+
+@pytest.mark.skipif("IMPORT_TIME_BUDGET_MS" not in os.environ, reason="IMPORT_TIME_BUDGET_MS not set")
+def test_import_main_within_budget():
+    measure_import(1)  # warms the bytecode and page caches
+    timings, _loaded = measure_import(5)
+    assert statistics.median(timings) <= IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,130 @@
+"""
+Crash recovery, replay and error handling of the write-behind journal, with
+a fake writer standing in for MongoDB.
+"""
+import os
+import time
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DocumentTooLarge, OperationFailure
+
+from journal import QuizJournal
+
+
+def make_quiz(heritage_id):
+    return {"_id": ObjectId(), "heritageId": heritage_id, "questions": []}
+
+
+class FakeWriter:
+    """Records every quiz written; raises `error` for batches containing a quiz of `reject`."""
+
+    def __init__(self, error=None, reject=None):
+        self.error = error
+        self.reject = reject
+        self.written = []
+
+    def __call__(self, quizzes):
+        if self.error is not None and (self.reject is None or any(q["heritageId"] in self.reject for q in quizzes)):
+            raise self.error
+        self.written.extend(q["heritageId"] for q in quizzes)
+
+
+def make_journal(tmp_path, writer):
+    return QuizJournal(str(tmp_path / "quiz_journal.jsonl"), writer=writer, id_resolver=lambda heritage_ids: {},
+                       flush_interval=0.01, fsync=0)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.01)
+
+
+def test_partial_append_is_dropped_and_complete_entries_recovered(tmp_path):
+    crashed = make_journal(tmp_path, FakeWriter(error=OperationFailure("down")))
+    crashed.append([make_quiz("h1")])
+    with open(crashed.path, "ab") as f:
+        f.write(b'{"ts": 1, "quizzes": [{"heritageId": "h2"')  # killed mid-write
+    size_before = os.path.getsize(crashed.path)
+
+    writer = FakeWriter()
+    journal = make_journal(tmp_path, writer)
+    journal.start()
+    try:
+        wait_until(lambda: journal.pending() == 0)
+    finally:
+        journal.shutdown()
+    assert writer.written == ["h1"]
+    assert os.path.getsize(journal.path) < size_before
+    assert not os.path.exists(journal.failed_path)
+
+
+def test_unflushed_entries_are_replayed_after_restart(tmp_path):
+    journal = make_journal(tmp_path, FakeWriter(error=OperationFailure("down")))
+    journal.start()
+    journal.append([make_quiz("h1")])
+    journal.append([make_quiz("h2"), make_quiz("h3")])
+    journal.shutdown()
+    assert journal.pending() == 2
+
+    writer = FakeWriter()
+    restarted = make_journal(tmp_path, writer)
+    restarted.start()
+    try:
+        wait_until(lambda: restarted.pending() == 0)
+    finally:
+        restarted.shutdown()
+    assert writer.written == ["h1", "h2", "h3"]
+    assert os.path.getsize(restarted.path) == 0
+
+
+def test_document_error_dead_letters_only_the_rejected_entry(tmp_path):
+    writer = FakeWriter(error=DocumentTooLarge("too large"), reject={"h2"})
+    journal = make_journal(tmp_path, writer)
+    for heritage_id in ("h1", "h2", "h3"):
+        journal.append([make_quiz(heritage_id)])
+    journal.start()
+    try:
+        wait_until(lambda: journal.pending() == 0)
+    finally:
+        journal.shutdown()
+    assert writer.written == ["h1", "h3"]
+    with open(journal.failed_path, "rb") as f:
+        failed = f.readlines()
+    assert len(failed) == 1 and b'"h2"' in failed[0]
+
+
+def test_systemic_error_keeps_every_entry(tmp_path):
+    writer = FakeWriter(error=OperationFailure("not authorized"))
+    journal = make_journal(tmp_path, writer)
+    journal.start()
+    journal.append([make_quiz("h1")])
+    journal.append([make_quiz("h2")])
+    time.sleep(0.2)
+    journal.shutdown()
+    assert journal.pending() == 2
+    assert not os.path.exists(journal.failed_path)
+
+    journal.writer = FakeWriter()
+    journal.start()
+    try:
+        wait_until(lambda: journal.pending() == 0)
+    finally:
+        journal.shutdown()
+    assert journal.writer.written == ["h1", "h2"]
+
+
+def test_second_writer_fails_fast(tmp_path):
+    journal = make_journal(tmp_path, FakeWriter())
+    journal.start()
+    try:
+        with pytest.raises(RuntimeError, match="in use"):
+            make_journal(tmp_path, FakeWriter()).start()
+    finally:
+        journal.shutdown()
+    other = make_journal(tmp_path, FakeWriter())
+    other.start()
+    other.shutdown()
@@ -0,0 +1,111 @@
+"""
+sync.diff_quiz on plain dicts: the updates it builds for typical edits of a
+quiz file, and the ids it keeps.
+"""
+import copy
+
+import pytest
+from pymongo import UpdateOne
+
+import sync
+
+NOW = 1_700_000_000
+FILTER = {"heritageId": "den-hung"}
+
+
+def make_question(question_id, content, explanation="", correct=0):
+    return {
+        "questionId": question_id,
+        "content": content,
+        "explanation": explanation,
+        "image": None,
+        "options": [{"optionId": f"{question_id}-{index}", "optionText": text, "isCorrect": index == correct}
+                    for index, text in enumerate(("Phú Thọ", "Hà Nội", "Huế"))],
+    }
+
+
+@pytest.fixture
+def stored():
+    return {
+        "_id": "stored-id",
+        "heritageId": "den-hung",
+        "title": "Đền Hùng",
+        "content": "Khu di tích lịch sử Đền Hùng",
+        "questions": [
+            make_question("s1", "Đền Hùng ở tỉnh nào?", "Núi Nghĩa Lĩnh"),
+            make_question("s2", "Giỗ Tổ vào ngày nào?"),
+        ],
+    }
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(sync.time, "time", lambda: NOW)
+
+
+def reparse(quiz):
+    """The same quiz as a fresh parse produces it: new _id, questionIds and optionIds."""
+    parsed = copy.deepcopy(quiz)
+    parsed["_id"] = "parsed-id"
+    for question in parsed["questions"]:
+        question["questionId"] = "new-" + question["questionId"]
+        for option in question["options"]:
+            option["optionId"] = "new-" + option["optionId"]
+    return parsed
+
+
+def test_unchanged_quiz_needs_no_update(stored):
+    parsed = reparse(stored)
+    operations, stats = sync.diff_quiz(stored, parsed)
+    assert operations == []
+    assert stats == {"questionsAdded": 0, "questionsRemoved": 0, "questionsChanged": 0}
+    assert parsed == stored
+
+
+def test_edited_explanation_sets_only_that_question(stored):
+    parsed = reparse(stored)
+    parsed["questions"][1]["explanation"] = "Mùng 10 tháng 3 âm lịch"
+    operations, stats = sync.diff_quiz(stored, parsed)
+
+    edited = parsed["questions"][1]
+    assert edited["questionId"] == "s2"
+    assert [option["optionId"] for option in edited["options"]] == ["s2-0", "s2-1", "s2-2"]
+    assert operations == [UpdateOne(FILTER, {"$set": {
+        "questions.$[q0].content": edited["content"],
+        "questions.$[q0].explanation": "Mùng 10 tháng 3 âm lịch",
+        "questions.$[q0].image": None,
+        "questions.$[q0].options": edited["options"],
+        "updatedAt": NOW,
+    }}, array_filters=[{"q0.questionId": "s2"}])]
+    assert stats == {"questionsAdded": 0, "questionsRemoved": 0, "questionsChanged": 1}
+
+
+def test_added_and_removed_questions(stored):
+    parsed = reparse(stored)
+    added = make_question("p3", "Vua Hùng thứ mấy dựng nước?")
+    parsed["questions"] = [parsed["questions"][0], added]
+    operations, stats = sync.diff_quiz(stored, parsed)
+
+    assert parsed["_id"] == "stored-id"
+    assert parsed["questions"][0]["questionId"] == "s1"
+    assert operations == [
+        UpdateOne(FILTER, {"$pull": {"questions": {"questionId": {"$in": ["s2"]}}}}),
+        UpdateOne(FILTER, {"$set": {"updatedAt": NOW}}),
+        UpdateOne(FILTER, {"$push": {"questions": {"$each": [added]}}}),
+    ]
+    assert stats == {"questionsAdded": 1, "questionsRemoved": 1, "questionsChanged": 0}
+
+
+def test_duplicate_content_question_gets_its_own_id(stored):
+    parsed = reparse(stored)
+    duplicate = make_question("p3", "  ĐỀN HÙNG ở tỉnh nào? ")
+    parsed["questions"].append(duplicate)
+    operations, stats = sync.diff_quiz(stored, parsed)
+
+    # Only the first question with that content takes over the stored id
+    assert [question["questionId"] for question in parsed["questions"]] == ["s1", "s2", "p3"]
+    assert operations == [
+        UpdateOne(FILTER, {"$set": {"updatedAt": NOW}}),
+        UpdateOne(FILTER, {"$push": {"questions": {"$each": [duplicate]}}}),
+    ]
+    assert stats == {"questionsAdded": 1, "questionsRemoved": 0, "questionsChanged": 0}